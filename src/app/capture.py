@@ -1,15 +1,111 @@
 import cv2
+import asyncio
 import threading
 import logging
-from queue import Queue
 from typing import Optional, Tuple
+from multiprocessing.shared_memory import SharedMemory
 import numpy as np
 import os
+import re
 
 logger = logging.getLogger(__name__)
 
+_gstreamer_support = None
+
+# camera.hwaccel -> (OpenCV FFmpeg acceleration type, GStreamer H.264 decoder)
+_HWACCEL_BACKENDS = {
+    'any': ('VIDEO_ACCELERATION_ANY', 'decodebin'),
+    'cuda': ('VIDEO_ACCELERATION_ANY', 'nvh264dec'),
+    'vaapi': ('VIDEO_ACCELERATION_VAAPI', 'vaapih264dec'),
+    'd3d11': ('VIDEO_ACCELERATION_D3D11', 'd3d11h264dec'),
+    'mfx': ('VIDEO_ACCELERATION_MFX', 'msdkh264dec'),
+}
+
+
+def gstreamer_available() -> bool:
+    """Whether this OpenCV build was compiled with the GStreamer backend"""
+    global _gstreamer_support
+    if _gstreamer_support is None:
+        build_info = cv2.getBuildInformation()
+        _gstreamer_support = re.search(r'GStreamer:\s*YES', build_info) is not None
+    return _gstreamer_support
+
+
+class SharedFrameRing:
+    """Single-producer ring of uint8 frames in POSIX shared memory.
+    
+    The header holds the total write count followed by one sequence word per
+    slot; a slot's sequence is odd while it is being written (seqlock), so
+    readers in other processes can attach by name and skip torn slots.
+    """
+    
+    def __init__(self, shape: Tuple[int, ...], slots: int = 8, name: Optional[str] = None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.owner = name is None
+        
+        frame_bytes = int(np.prod(self.shape))
+        header_bytes = ((slots + 1) * 8 + 63) // 64 * 64
+        
+        if self.owner:
+            self.shm = SharedMemory(create=True, size=header_bytes + slots * frame_bytes)
+        else:
+            self.shm = SharedMemory(name=name)
+            
+        self._header = np.ndarray((slots + 1,), dtype=np.uint64, buffer=self.shm.buf)
+        self._frames = np.ndarray(
+            (slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf, offset=header_bytes
+        )
+        
+        if self.owner:
+            self._header[:] = 0
+            
+    @classmethod
+    def attach(cls, name: str, shape: Tuple[int, ...], slots: int = 8) -> 'SharedFrameRing':
+        return cls(shape, slots, name=name)
+        
+    @property
+    def name(self) -> str:
+        return self.shm.name
+        
+    def begin_write(self) -> np.ndarray:
+        """Mark the next slot as in-progress and return a writable view of it"""
+        count = int(self._header[0])
+        slot = count % self.slots
+        self._header[1 + slot] = 2 * count + 1
+        return self._frames[slot]
+        
+    def commit(self) -> np.ndarray:
+        """Publish the slot opened by begin_write and return a view of it"""
+        count = int(self._header[0])
+        slot = count % self.slots
+        self._header[1 + slot] = 2 * count + 2
+        self._header[0] = count + 1
+        return self._frames[slot]
+        
+    def latest(self) -> Optional[np.ndarray]:
+        """View of the most recent completed frame, or None"""
+        count = int(self._header[0])
+        if count == 0:
+            return None
+        slot = (count - 1) % self.slots
+        if int(self._header[1 + slot]) & 1:
+            return None
+        return self._frames[slot]
+        
+    def close(self):
+        del self._header, self._frames
+        try:
+            self.shm.close()
+        except BufferError:
+            logger.warning("Shared frame ring still referenced by consumers, leaving it mapped")
+        if self.owner:
+            self.shm.unlink()
+
 
 class CameraCapture:
+    """RTSP reader; every published frame is a C-contiguous BGR uint8 ndarray (H, W, 3)"""
+    
     def __init__(self, config):
         self.config = config.get('camera', {})
         self.rtsp_url = self.config.get('rtsp_url', '')
@@ -17,24 +113,80 @@ class CameraCapture:
         self.width = self.config.get('width', 1280)
         self.height = self.config.get('height', 720)
         
+        # RTSP over GStreamer: UDP transport and a 1-buffer dropping appsink
+        self.use_gstreamer = self.config.get('gstreamer', True)
+        self.protocols = self.config.get('protocols', 'udp')
+        self.latency = self.config.get('latency', 0)
+        
+        # Hardware H.264 decode (NVDEC/VAAPI/...), off when unset
+        self.hwaccel = self.config.get('hwaccel')
+        if self.hwaccel and self.hwaccel not in _HWACCEL_BACKENDS:
+            logger.warning(f"Unknown hwaccel '{self.hwaccel}', using software decode")
+            self.hwaccel = None
+        
+        # Let annotated frames live in OpenCL device memory as cv2.UMat
+        self.use_opencl = self.config.get('opencl', False)
+        if self.use_opencl:
+            cv2.ocl.setUseOpenCL(True)
+            logger.info(f"OpenCL enabled: {cv2.ocl.useOpenCL()}")
+        
+        # Keep the camera's own JPEGs (UVC MJPG mode, MJPEG RTSP) so the raw stream
+        # can serve them without re-encoding; frames are decoded with imdecode
+        self.mjpeg = self.config.get('mjpeg', False)
+        
         self.cap = None
-        self.frame_queue = Queue(maxsize=10)
         self.latest_frame = None
+        self.latest_jpeg: Optional[memoryview] = None
         self.latest_annotated = None
+        self.frame_seq = 0
+        self.annotated_seq = 0
+        # frame_seq of the raw frame published unchanged as the annotated one, else None
+        self.annotated_source_seq = None
         self.lock = threading.Lock()
+        self.frame_ready = threading.Condition(self.lock)
+        self._frame_requested = threading.Event()
+        # asyncio.Event per stream ("raw", "annotated"), swapped for a fresh one each
+        # time a frame is published so every waiter wakes without racing on clear()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._frame_events = {}
         self.running = False
         self.thread = None
         
+        # Optionally decode frames straight into a shared memory ring so other
+        # processes can attach by name; views stay valid for ring_size frames
+        self.use_shared_memory = self.config.get('shared_memory', False)
+        self.ring_size = self.config.get('ring_size', 8)
+        self.ring: Optional[SharedFrameRing] = None
+        
+        if self.mjpeg and self.use_shared_memory:
+            logger.warning("Shared memory ring is not used in MJPEG mode")
+            self.use_shared_memory = False
+        
         self._connect()
         
     def _connect(self):
         logger.info(f"Connecting to camera: {self.rtsp_url}")
         
+        self.cap = None
+        
         if self.rtsp_url.startswith('rtsp://'):
-            os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = 'rtsp_transport;tcp'
-            
-            self.cap = cv2.VideoCapture(self.rtsp_url, cv2.CAP_FFMPEG)
-            
+            # The GStreamer pipeline is built for H.264 only
+            if self.use_gstreamer and not self.mjpeg and gstreamer_available():
+                self.cap = cv2.VideoCapture(self._gstreamer_pipeline(), cv2.CAP_GSTREAMER)
+                
+                if not self.cap.isOpened():
+                    logger.warning("GStreamer pipeline failed, falling back to FFmpeg...")
+                    
+            if self.cap is None or not self.cap.isOpened():
+                os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = 'rtsp_transport;tcp'
+                
+                params = self._ffmpeg_params()
+                # The params overload needs OpenCV >= 4.5.2; only use it for hwaccel
+                if params:
+                    self.cap = cv2.VideoCapture(self.rtsp_url, cv2.CAP_FFMPEG, params)
+                else:
+                    self.cap = cv2.VideoCapture(self.rtsp_url, cv2.CAP_FFMPEG)
+                
             if not self.cap.isOpened():
                 logger.warning("FFmpeg backend failed, trying default backend...")
                 self.cap = cv2.VideoCapture(self.rtsp_url)
@@ -49,6 +201,9 @@ class CameraCapture:
             logger.error("Failed to open camera stream")
             raise ConnectionError("Cannot connect to camera")
         
+        if self.mjpeg:
+            self._enable_mjpeg_passthrough()
+        
         self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
@@ -60,6 +215,34 @@ class CameraCapture:
         
         logger.info(f"Camera connected: {actual_width}x{actual_height} @ {actual_fps}fps")
         
+    def _enable_mjpeg_passthrough(self):
+        """Have retrieve() return the camera's compressed JPEG instead of a decoded frame"""
+        if self.cap.getBackendName() == 'V4L2':
+            # FOURCC has to be set before the frame size for V4L2 to keep it
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+            self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        else:
+            # FFmpeg hands out undecoded packets in raw mode
+            self.cap.set(cv2.CAP_PROP_FORMAT, -1)
+            
+    def _ffmpeg_params(self) -> list:
+        if not self.hwaccel:
+            return []
+        accel = getattr(cv2, _HWACCEL_BACKENDS[self.hwaccel][0], None)
+        if accel is None or not hasattr(cv2, 'CAP_PROP_HW_ACCELERATION'):
+            logger.warning("OpenCV build lacks hardware decode support, using software decode")
+            return []
+        return [cv2.CAP_PROP_HW_ACCELERATION, accel]
+        
+    def _gstreamer_pipeline(self) -> str:
+        decoder = _HWACCEL_BACKENDS[self.hwaccel][1] if self.hwaccel else 'avdec_h264'
+        return (
+            f"rtspsrc location={self.rtsp_url} latency={self.latency} protocols={self.protocols} "
+            f"! rtph264depay ! h264parse ! {decoder} ! videoconvert "
+            "! video/x-raw,format=BGR "
+            "! appsink drop=true max-buffers=1 sync=false"
+        )
+        
     def start(self):
         if self.running:
             return
@@ -74,9 +257,10 @@ class CameraCapture:
         max_failures = 30
         
         while self.running:
-            ret, frame = self.cap.read()
-            
-            if not ret:
+            # grab() keeps the backend from building a backlog. With FFmpeg it still
+            # decodes every frame; only retrieve()'s color conversion and copy into
+            # a BGR array are skipped until a consumer has asked for a frame
+            if not self.cap.grab():
                 consecutive_failures += 1
                 logger.warning(f"Failed to read frame ({consecutive_failures}/{max_failures})")
                 
@@ -87,36 +271,197 @@ class CameraCapture:
                 continue
             
             consecutive_failures = 0
+            
+            if not self._frame_requested.is_set():
+                continue
+                
+            self._frame_requested.clear()
+            
+            jpeg = None
+            
+            if self.use_shared_memory:
+                ret, frame = self._retrieve_into_ring()
+            elif self.mjpeg:
+                ret, frame, jpeg = self._retrieve_mjpeg()
+            else:
+                ret, frame = self.cap.retrieve()
+            
+            if not ret:
+                continue
                 
-            with self.lock:
-                self.latest_frame = frame.copy()
+            # retrieve() hands back a fresh buffer every call, so publishing
+            # the reference is safe as long as nobody mutates it afterwards
+            with self.frame_ready:
+                self.latest_frame = frame
+                self.latest_jpeg = jpeg
+                self.frame_seq += 1
+                self.frame_ready.notify_all()
                 
-            if not self.frame_queue.full():
-                self.frame_queue.put(frame)
+            self._signal_frame('raw')
                 
+    def _retrieve_mjpeg(self) -> Tuple[bool, Optional[np.ndarray], Optional[memoryview]]:
+        """(ok, decoded frame, camera JPEG) from a passthrough capture"""
+        ret, packet = self.cap.retrieve()
+        if not ret:
+            return False, None, None
+            
+        if packet.ndim == 3:
+            # Backend ignored the request and decoded the frame itself
+            logger.warning("Camera does not deliver MJPEG, the raw stream will be re-encoded")
+            self.mjpeg = False
+            return True, packet, None
+            
+        jpeg = packet.reshape(-1)
+        if jpeg[:2].tobytes() != b'\xff\xd8':
+            # Raw mode cannot be switched off again, so reopen without it
+            logger.warning("Camera packets are not JPEG, reconnecting without MJPEG passthrough")
+            self.mjpeg = False
+            self._reconnect()
+            return False, None, None
+            
+        frame = cv2.imdecode(jpeg, cv2.IMREAD_COLOR)
+        if frame is None:
+            return False, None, None
+        return True, frame, memoryview(jpeg)
+        
+    def _retrieve_into_ring(self) -> Tuple[bool, Optional[np.ndarray]]:
+        if self.ring is None:
+            ret, frame = self.cap.retrieve()
+            if not ret:
+                return False, None
+            self.ring = SharedFrameRing(frame.shape, self.ring_size)
+            logger.info(f"Shared frame ring '{self.ring.name}': {self.ring_size} x {frame.shape}")
+            self.ring.begin_write()[...] = frame
+            return True, self.ring.commit()
+            
+        slot = self.ring.begin_write()
+        ret, frame = self.cap.retrieve(slot)
+        
+        if not ret:
+            return False, None
+            
+        if frame.shape != self.ring.shape:
+            # Resolution changed (e.g. after a reconnect): start a new ring
+            self.ring.commit()
+            self.ring.close()
+            self.ring = None
+            return True, frame
+            
+        if not np.shares_memory(frame, slot):
+            slot[...] = frame
+            
+        return True, self.ring.commit()
+        
+    @property
+    def shm_name(self) -> Optional[str]:
+        """Name other processes pass to SharedFrameRing.attach()"""
+        return self.ring.name if self.ring else None
+        
     def _reconnect(self):
         self.cap.release()
         import time
         time.sleep(2)
         self._connect()
         
-    def get_frame(self) -> Optional[np.ndarray]:
-        try:
-            return self.frame_queue.get(timeout=1)
-        except:
-            return None
+    def get_frame(self, timeout: float = 1.0) -> Optional[np.ndarray]:
+        """Wait for a frame decoded after this call; treat it as read-only"""
+        return self.get_frame_tagged(timeout)[1]
+        
+    def get_frame_tagged(self, timeout: float = 1.0, owned: bool = False) -> Tuple[int, Optional[np.ndarray]]:
+        """(frame_seq, frame) of a frame decoded after this call, frame None on timeout.
+        
+        owned=True copies ring slot views out, for callers that hold frames longer
+        than ring_size decodes (pipeline queues, published annotated frames).
+        """
+        with self.frame_ready:
+            seq = self.frame_seq
+            self._frame_requested.set()
+            if not self.frame_ready.wait_for(lambda: self.frame_seq != seq, timeout=timeout):
+                return seq, None
+            seq, frame = self.frame_seq, self.latest_frame
+            
+        # The slot stays intact for ring_size more decodes, so copying outside the lock is safe
+        if owned and self.use_shared_memory:
+            frame = frame.copy()
+        return seq, frame
             
     def get_latest_frame(self) -> Optional[np.ndarray]:
+        """Shared reference to the newest frame; treat it as read-only"""
+        # Ask for the next grabbed frame to be decoded so pollers stay current
+        self._frame_requested.set()
         with self.lock:
-            return self.latest_frame.copy() if self.latest_frame is not None else None
+            return self.latest_frame
+            
+    def get_latest_frame_tagged(self) -> Tuple[int, Optional[np.ndarray]]:
+        """(frame_seq, frame) of the newest frame; the seq identifies it for caching"""
+        self._frame_requested.set()
+        with self.lock:
+            return self.frame_seq, self.latest_frame
+            
+    def get_latest_jpeg_tagged(self) -> Tuple[int, Optional[memoryview]]:
+        """(frame_seq, camera JPEG) of the newest frame; the JPEG is None unless in MJPEG mode"""
+        self._frame_requested.set()
+        with self.lock:
+            return self.frame_seq, self.latest_jpeg
+            
+    def _signal_frame(self, kind: str):
+        """Wake async waiters for this stream; safe to call from any thread"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._set_frame_event, kind)
             
-    def get_latest_annotated(self) -> Optional[np.ndarray]:
+    def _set_frame_event(self, kind: str):
+        event = self._frame_events.pop(kind, None)
+        if event is not None:
+            event.set()
+            
+    async def wait_for_frame(self, kind: str = 'raw', timeout: float = 1.0) -> bool:
+        """Wait until a new raw or annotated frame is published, False on timeout"""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            
+        event = self._frame_events.get(kind)
+        if event is None:
+            event = self._frame_events[kind] = asyncio.Event()
+            
+        if kind == 'raw':
+            # Frames are only decoded on request
+            self._frame_requested.set()
+            
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+            
+    def get_latest_annotated(self):
+        """Shared reference to the newest annotated frame (ndarray or cv2.UMat); treat it as read-only"""
         with self.lock:
-            return self.latest_annotated.copy() if self.latest_annotated is not None else None
+            return self.latest_annotated
+            
+    def get_latest_annotated_host(self) -> Optional[np.ndarray]:
+        """Newest annotated frame as a host ndarray, downloading it if it is a UMat"""
+        frame = self.get_latest_annotated()
+        if isinstance(frame, cv2.UMat):
+            return frame.get()
+        return frame
             
-    def set_annotated_frame(self, frame: np.ndarray):
+    def get_latest_annotated_tagged(self) -> Tuple[int, Optional[int], Optional[np.ndarray]]:
+        """(annotated_seq, source raw seq or None, host frame) of the newest annotated frame"""
         with self.lock:
-            self.latest_annotated = frame.copy()
+            seq, source_seq, frame = self.annotated_seq, self.annotated_source_seq, self.latest_annotated
+        if isinstance(frame, cv2.UMat):
+            frame = frame.get()
+        return seq, source_seq, frame
+        
+    def set_annotated_frame(self, frame, source_seq: Optional[int] = None):
+        """Publish an annotated frame; the caller must not modify it afterwards"""
+        # source_seq marks a raw frame published with nothing drawn on it
+        with self.lock:
+            self.latest_annotated = frame
+            self.annotated_source_seq = source_seq
+            self.annotated_seq += 1
+            
+        self._signal_frame('annotated')
             
     def release(self):
         self.running = False
@@ -124,4 +469,6 @@ class CameraCapture:
             self.thread.join(timeout=2)
         if self.cap:
             self.cap.release()
+        if self.ring:
+            self.ring.close()
         logger.info("Camera released")
\ No newline at end of file
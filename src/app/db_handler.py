@@ -1,11 +1,31 @@
-from pymongo import MongoClient, ASCENDING
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient, ASCENDING, ReturnDocument, UpdateOne
+from bson import Binary
 from typing import List, Dict, Optional
+import asyncio
 import logging
+import time
+import numpy as np
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
 
+def encode_embedding(embedding: np.ndarray) -> Binary:
+    """Pack an embedding as a raw little-endian FP32 BSON blob"""
+    return Binary(np.asarray(embedding, dtype='<f4').tobytes())
+
+
+def decode_embedding(document: Dict) -> np.ndarray:
+    """Read a stored embedding, accepting both FP32 blobs and legacy float lists"""
+    embedding = document.get('embedding')
+    if embedding is None:
+        return np.empty(0, dtype=np.float32)
+    if isinstance(embedding, (bytes, Binary)):
+        return np.frombuffer(embedding, dtype='<f4')
+    return np.asarray(embedding, dtype=np.float32)
+
+
 class DatabaseHandler:
     def __init__(self, config):
         self.config = config.get('database', {})
@@ -14,36 +34,51 @@ class DatabaseHandler:
         db_name = self.config.get('db_name', 'face_id')
         self.collection_name = self.config.get('collection_name', 'persons')
         
+        # Hot-path updates are queued and flushed with one bulk_write
+        self.write_batch_size = self.config.get('write_batch_size', 64)
+        self.flush_interval = self.config.get('flush_interval_ms', 250) / 1000.0
+        self._pending_ops: List[UpdateOne] = []
+        self._flush_lock = asyncio.Lock()
+        self._last_flush = time.monotonic()
+        
         logger.info(f"Connecting to MongoDB: {mongo_uri}")
-        self.client = MongoClient(mongo_uri)
+        self._create_indexes(mongo_uri, db_name)
+        
+        # All runtime queries go through Motor so they never block the event loop
+        self.client = AsyncIOMotorClient(mongo_uri)
         self.db = self.client[db_name]
         self.collection = self.db[self.collection_name]
-        
-        self._create_indexes()
         logger.info("MongoDB connected successfully")
         
-    def _create_indexes(self):
-        self.collection.create_index([("person_id", ASCENDING)], unique=True)
-        self.collection.create_index([("first_seen", ASCENDING)])
-        self.collection.create_index([("last_seen", ASCENDING)])
+    def _create_indexes(self, mongo_uri: str, db_name: str):
+        """Create indexes with a short-lived sync client so startup stays synchronous"""
+        with MongoClient(mongo_uri) as client:
+            collection = client[db_name][self.collection_name]
+            collection.create_index([("person_id", ASCENDING)], unique=True)
+            collection.create_index([("first_seen", ASCENDING)])
+            collection.create_index([("last_seen", ASCENDING)])
         
-    def insert_person(
+    async def insert_person(
         self,
         person_id: str,
-        embedding: List[float],
+        embedding: np.ndarray,
         first_seen: datetime,
         last_seen: datetime
     ) -> bool:
         try:
+            # Store unit-length vectors so matching is a plain inner product
+            embedding = np.asarray(embedding, dtype=np.float32).ravel()
+            embedding = embedding / (np.linalg.norm(embedding) + 1e-6)
             document = {
                 'person_id': person_id,
-                'embedding': embedding,
+                'embedding': encode_embedding(embedding),
+                'dim': int(embedding.shape[0]),
                 'first_seen': first_seen,
                 'last_seen': last_seen,
                 'detection_count': 1
             }
             
-            self.collection.insert_one(document)
+            await self.collection.insert_one(document)
             logger.info(f"Inserted person: {person_id}")
             return True
             
@@ -51,47 +86,132 @@ class DatabaseHandler:
             logger.error(f"Error inserting person: {e}")
             return False
             
-    def update_person(self, person_id: str, last_seen: datetime) -> bool:
+    async def update_person(self, person_id: str, last_seen: datetime) -> bool:
+        """Queue a last_seen/detection_count update, flushing when the batch is due"""
+        op = UpdateOne(
+            {'person_id': person_id},
+            {
+                '$set': {'last_seen': last_seen},
+                '$inc': {'detection_count': 1}
+            }
+        )
+        
+        self._pending_ops.append(op)
+        due = (
+            len(self._pending_ops) >= self.write_batch_size
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        )
+            
+        if due:
+            return await self.flush()
+        return True
+        
+    async def touch_person(self, person_id: str, last_seen: datetime) -> Optional[Dict]:
+        """Apply a sighting immediately and return the updated document in one round-trip"""
         try:
-            result = self.collection.update_one(
+            return await self.collection.find_one_and_update(
                 {'person_id': person_id},
                 {
                     '$set': {'last_seen': last_seen},
                     '$inc': {'detection_count': 1}
-                }
+                },
+                projection={'embedding': 0},
+                return_document=ReturnDocument.AFTER
             )
+        except Exception as e:
+            logger.error(f"Error touching person: {e}")
+            return None
             
-            return result.modified_count > 0
+    async def flush(self) -> bool:
+        async with self._flush_lock:
+            ops = self._pending_ops
+            self._pending_ops = []
+            self._last_flush = time.monotonic()
             
-        except Exception as e:
-            logger.error(f"Error updating person: {e}")
-            return False
+            if not ops:
+                return True
+                
+            try:
+                result = await self.collection.bulk_write(ops, ordered=False)
+                logger.debug(f"Flushed {len(ops)} updates ({result.modified_count} modified)")
+                return True
+                
+            except Exception as e:
+                logger.error(f"Error flushing {len(ops)} updates: {e}")
+                return False
             
-    def get_person(self, person_id: str) -> Optional[Dict]:
+    async def run_flusher(self):
+        """Flush queued updates periodically so a quiet stream still persists"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            
+    async def get_person(self, person_id: str, include_embedding: bool = False) -> Optional[Dict]:
         try:
-            return self.collection.find_one({'person_id': person_id})
+            projection = None if include_embedding else {'embedding': 0}
+            return await self.collection.find_one({'person_id': person_id}, projection)
         except Exception as e:
             logger.error(f"Error getting person: {e}")
             return None
             
-    def get_all_persons(self) -> List[Dict]:
+    async def get_all_persons(self, include_embedding: bool = False) -> List[Dict]:
         try:
-            return list(self.collection.find({}))
+            projection = None if include_embedding else {'embedding': 0}
+            return await self.collection.find({}, projection).to_list(length=None)
         except Exception as e:
             logger.error(f"Error getting all persons: {e}")
             return []
             
-    def delete_person(self, person_id: str) -> bool:
+    async def get_all_persons_with_embeddings(self) -> List[Dict]:
+        """Every stored person with its embedding; raises on error"""
+        # Not swallowed like get_all_persons: an empty result would replace the gallery
+        return await self.collection.find({}).to_list(length=None)
+            
+    async def watch(self, pipeline: Optional[List[Dict]] = None):
+        """Open a change stream on the collection, or None when unsupported"""
+        try:
+            hello = await self.client.admin.command('hello')
+        except Exception as e:
+            logger.error(f"Error checking change stream support: {e}")
+            return None
+            
+        # Change streams need a replica set or a sharded cluster
+        if 'setName' not in hello and hello.get('msg') != 'isdbgrid':
+            logger.warning("Change streams unavailable: MongoDB is a standalone server")
+            return None
+            
+        if pipeline is None:
+            # Inserts, deletes, and updates that touch the embedding; the
+            # last_seen/detection_count churn is filtered out server-side
+            pipeline = [{
+                '$match': {
+                    '$or': [
+                        {'operationType': {'$in': ['insert', 'replace', 'delete']}},
+                        {
+                            'operationType': 'update',
+                            'updateDescription.updatedFields.embedding': {'$exists': True}
+                        }
+                    ]
+                }
+            }]
+            
+        return self.collection.watch(
+            pipeline,
+            full_document='updateLookup',
+            max_await_time_ms=1000
+        )
+            
+    async def delete_person(self, person_id: str) -> bool:
         try:
-            result = self.collection.delete_one({'person_id': person_id})
+            result = await self.collection.delete_one({'person_id': person_id})
             return result.deleted_count > 0
         except Exception as e:
             logger.error(f"Error deleting person: {e}")
             return False
             
-    def get_statistics(self) -> Dict:
+    async def get_statistics(self) -> Dict:
         try:
-            total_persons = self.collection.count_documents({})
+            total_persons = await self.collection.count_documents({})
             
             pipeline = [
                 {
@@ -102,13 +222,17 @@ class DatabaseHandler:
                 }
             ]
             
-            result = list(self.collection.aggregate(pipeline))
+            result = await self.collection.aggregate(pipeline).to_list(length=None)
             total_detections = result[0]['total_detections'] if result else 0
             
-            recent_persons = list(
-                self.collection.find({})
+            recent_persons = await (
+                self.collection.find(
+                    {},
+                    {'_id': 0, 'person_id': 1, 'last_seen': 1, 'detection_count': 1}
+                )
                 .sort('last_seen', -1)
                 .limit(10)
+                .to_list(length=10)
             )
             
             return {
@@ -128,6 +252,7 @@ class DatabaseHandler:
             logger.error(f"Error getting statistics: {e}")
             return {}
             
-    def close(self):
+    async def close(self):
+        await self.flush()
         self.client.close()
         logger.info("MongoDB connection closed")
\ No newline at end of file
@@ -0,0 +1,145 @@
+import cv2
+import numpy as np
+import logging
+from typing import List, Tuple
+from insightface.app.common import Face
+from insightface.model_zoo.scrfd import distance2bbox, distance2kps
+
+logger = logging.getLogger(__name__)
+
+
+class BatchDetector:
+    """Runs the FaceAnalysis SCRFD detector on several frames in one ONNX call"""
+    
+    def __init__(self, app, input_size: Tuple[int, int] = (640, 640)):
+        self.app = app
+        self.det_model = app.det_model
+        self.input_size = tuple(self.det_model.input_size or input_size)
+        
+        # Batching needs a (B, K, C) output layout and a dynamic batch dimension
+        batch_dim = self.det_model.session.get_inputs()[0].shape[0]
+        self.supports_batch = self.det_model.batched and not isinstance(batch_dim, int)
+        
+        if not self.supports_batch:
+            logger.info("Detector model has a fixed batch size, detecting frames one at a time")
+            
+        # Letterbox canvases reused across calls; callers run detection from one thread
+        self._canvases: List[np.ndarray] = []
+            
+    def _letterbox(self, frame: np.ndarray, slot: int) -> Tuple[np.ndarray, float]:
+        """Resize into the top-left corner of a reused model-sized canvas, keeping aspect ratio"""
+        input_w, input_h = self.input_size
+        im_ratio = float(frame.shape[0]) / frame.shape[1]
+        
+        if im_ratio > float(input_h) / input_w:
+            new_h = input_h
+            new_w = int(new_h / im_ratio)
+        else:
+            new_w = input_w
+            new_h = int(new_w * im_ratio)
+            
+        while len(self._canvases) <= slot:
+            self._canvases.append(np.zeros((input_h, input_w, 3), dtype=np.uint8))
+            
+        det_img = self._canvases[slot]
+        det_img[:new_h, :new_w] = cv2.resize(frame, (new_w, new_h))
+        # Only the padding has to be cleared of the previous frame
+        det_img[new_h:] = 0
+        det_img[:new_h, new_w:] = 0
+        return det_img, float(new_h) / frame.shape[0]
+        
+    def _anchor_centers(self, height: int, width: int, stride: int) -> np.ndarray:
+        det = self.det_model
+        key = (height, width, stride)
+        
+        if key not in det.center_cache:
+            anchor_centers = np.stack(np.mgrid[:height, :width][::-1], axis=-1).astype(np.float32)
+            anchor_centers = (anchor_centers * stride).reshape((-1, 2))
+            if det._num_anchors > 1:
+                anchor_centers = np.stack([anchor_centers] * det._num_anchors, axis=1).reshape((-1, 2))
+            det.center_cache[key] = anchor_centers
+            
+        return det.center_cache[key]
+        
+    def _decode(self, net_outs: List[np.ndarray], b: int, det_scale: float):
+        """Turn the b-th slice of the network outputs into (det, kpss) like SCRFD.detect"""
+        det = self.det_model
+        input_w, input_h = self.input_size
+        fmc = det.fmc
+        scores_list, bboxes_list, kpss_list = [], [], []
+        
+        # Unbatched models return (K, C) outputs for their single image
+        def select(out):
+            return out[b] if det.batched else out
+            
+        for idx, stride in enumerate(det._feat_stride_fpn):
+            scores = select(net_outs[idx])
+            bbox_preds = select(net_outs[idx + fmc]) * stride
+            anchor_centers = self._anchor_centers(input_h // stride, input_w // stride, stride)
+            
+            pos_inds = np.where(scores >= det.det_thresh)[0]
+            scores_list.append(scores[pos_inds])
+            bboxes_list.append(distance2bbox(anchor_centers, bbox_preds)[pos_inds])
+            
+            if det.use_kps:
+                kps_preds = select(net_outs[idx + fmc * 2]) * stride
+                kpss = distance2kps(anchor_centers, kps_preds).reshape((-1, 5, 2))
+                kpss_list.append(kpss[pos_inds])
+                
+        scores = np.vstack(scores_list)
+        order = scores.ravel().argsort()[::-1]
+        bboxes = np.vstack(bboxes_list) / det_scale
+        
+        pre_det = np.hstack((bboxes, scores)).astype(np.float32, copy=False)[order, :]
+        keep = det.nms(pre_det)
+        
+        kpss = None
+        if det.use_kps:
+            kpss = (np.vstack(kpss_list) / det_scale)[order][keep]
+            
+        return pre_det[keep, :], kpss
+        
+    def _build_faces(self, frame: np.ndarray, bboxes: np.ndarray, kpss) -> List[Face]:
+        """Run the per-face models (landmarks, recognition, ...) as FaceAnalysis.get does"""
+        faces = []
+        for i in range(bboxes.shape[0]):
+            face = Face(
+                bbox=bboxes[i, 0:4],
+                kps=kpss[i] if kpss is not None else None,
+                det_score=bboxes[i, 4]
+            )
+            for taskname, model in self.app.models.items():
+                if taskname == 'detection':
+                    continue
+                model.get(frame, face)
+            faces.append(face)
+        return faces
+        
+    def get(self, frame: np.ndarray) -> List[Face]:
+        """Detect faces on one frame, equivalent to FaceAnalysis.get"""
+        return self._run([frame])[0]
+        
+    def get_batch(self, frames: List[np.ndarray]) -> List[List[Face]]:
+        """Detect faces on every frame, in a single inference when the model allows it"""
+        if self.supports_batch:
+            return self._run(frames)
+        return [self._run([frame])[0] for frame in frames]
+        
+    def _run(self, frames: List[np.ndarray]) -> List[List[Face]]:
+        det = self.det_model
+        letterboxed = [self._letterbox(frame, slot) for slot, frame in enumerate(frames)]
+        
+        blob = cv2.dnn.blobFromImages(
+            [img for img, _ in letterboxed],
+            1.0 / det.input_std,
+            self.input_size,
+            (det.input_mean, det.input_mean, det.input_mean),
+            swapRB=True
+        )
+        net_outs = det.session.run(det.output_names, {det.input_name: blob})
+        
+        results = []
+        for b, (frame, (_, det_scale)) in enumerate(zip(frames, letterboxed)):
+            bboxes, kpss = self._decode(net_outs, b, det_scale)
+            results.append(self._build_faces(frame, bboxes, kpss) if bboxes.shape[0] else [])
+        return results
\ No newline at end of file
@@ -44,26 +44,40 @@ class FaceIDSystem:
         logger.info("Starting Face ID System...")
         
         try:
+            await self.matcher.start()
+            
             api_task = asyncio.create_task(
-                start_api_server(self.config, self.camera, self.db_handler)
+                start_api_server(self.config, self.camera, self.db_handler, self.notifier)
             )
             
             processing_task = asyncio.create_task(
                 self.pipeline.process_stream(self.camera)
             )
             
-            await asyncio.gather(api_task, processing_task)
+            flush_task = asyncio.create_task(
+                self.db_handler.run_flusher()
+            )
+            
+            await asyncio.gather(api_task, processing_task, flush_task)
         except KeyboardInterrupt:
             logger.info("Shutting down gracefully...")
         except Exception as e:
             logger.error(f"System error: {e}", exc_info=True)
         finally:
             logger.info("Cleaning up resources...")
+            await self.matcher.stop()
             self.camera.release()
-            self.db_handler.close()
+            await self.db_handler.close()
             logger.info("Shutdown complete")
 
 
 if __name__ == "__main__":
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        logger.info("Using uvloop event loop")
+    except ImportError:
+        logger.info("uvloop not available, using default asyncio event loop")
+        
     system = FaceIDSystem()
     asyncio.run(system.run())
\ No newline at end of file
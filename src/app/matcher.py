@@ -1,12 +1,72 @@
 import numpy as np
+import asyncio
 import logging
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime
 from utils.id_generator import generate_unique_id
+from db_handler import decode_embedding
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
 
 logger = logging.getLogger(__name__)
 
 
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _argmax_cosine(E, q):
+        """Parallel inner-product scan over normalized rows, returns (best_idx, best_sim)"""
+        n, d = E.shape
+        sims = np.empty(n, dtype=np.float32)
+        
+        for i in numba.prange(n):
+            s = np.float32(0.0)
+            for j in range(d):
+                s += E[i, j] * q[j]
+            sims[i] = s
+            
+        best_idx = 0
+        for i in range(1, n):
+            if sims[i] > sims[best_idx]:
+                best_idx = i
+                
+        return best_idx, sims[best_idx]
+        
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _argmax_cosine_int8(E_q, scales, q_q, q_scale):
+        """Int8 inner-product scan with int32 accumulation, rescaled to FP32 at the end"""
+        n, d = E_q.shape
+        sims = np.empty(n, dtype=np.float32)
+        
+        for i in numba.prange(n):
+            acc = np.int32(0)
+            for j in range(d):
+                acc += np.int32(E_q[i, j]) * np.int32(q_q[j])
+            sims[i] = acc * scales[i] * q_scale
+            
+        best_idx = 0
+        for i in range(1, n):
+            if sims[i] > sims[best_idx]:
+                best_idx = i
+                
+        return best_idx, sims[best_idx]
+
+
+def _quantize(v: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric int8 quantization with one scale per vector (last axis)"""
+    v = np.asarray(v, dtype=np.float32)
+    scale = np.abs(v).max(axis=-1, keepdims=True) / 127.0 + 1e-12
+    q = np.clip(np.rint(v / scale), -127, 127).astype(np.int8)
+    return q, scale.squeeze(-1).astype(np.float32)
+
+
 class FaceMatcher:
     def __init__(self, config, db_handler):
         self.config = config.get('matching', {})
@@ -15,16 +75,384 @@ class FaceMatcher:
         self.threshold = self.config.get('threshold', 0.6)
         self.min_confidence = self.config.get('min_confidence', 0.7)
         
-        logger.info(f"FaceMatcher initialized with threshold={self.threshold}")
+        self.index_type = self.config.get('index_type', 'flat')
+        self.hnsw_m = self.config.get('hnsw_m', 32)
+        self.use_faiss = faiss is not None and self.config.get('use_faiss', True)
+        self.use_numba = numba is not None and self.config.get('use_numba', True)
+        self.quantize = self.config.get('quantize')
+        
+        if self.quantize == 'int8' and not (self.use_faiss or self.use_numba):
+            logger.warning("int8 quantization needs faiss or numba, falling back to FP32")
+            self.quantize = None
+        elif self.quantize == 'fp16' and not self.use_faiss:
+            logger.warning("fp16 storage needs faiss, falling back to FP32")
+            self.quantize = None
+        
+        # In-memory cache of L2-normalized embeddings, one row per person
+        self.E = np.empty((0, 0), dtype=np.float32)
+        self.person_ids: List[str] = []
+        self.person_meta: Dict[str, Dict] = {}
+        self.index = None
+        self.E_q = np.empty((0, 0), dtype=np.int8)
+        self.scales = np.empty(0, dtype=np.float32)
+        self._doc_ids: Dict[Any, str] = {}
+        # Rows appended while a reload reads its snapshot, carried over when it is swapped in
+        self._added_during_reload: Optional[Dict[str, np.ndarray]] = None
+        
+        # The cache is only read and replaced on the event loop, with no await between
+        # related updates, so it needs no lock
+        self.reload_interval = self.config.get('reload_interval_seconds', 30)
+        self._sync_task: Optional[asyncio.Task] = None
+        
+        # Concurrent match_face calls are gathered into one (B, D) search
+        self.batch_window = self.config.get('batch_window_ms', 5) / 1000.0
+        self._query_queue: Optional[asyncio.Queue] = None
+        self._batch_task: Optional[asyncio.Task] = None
+        
+        if self.use_faiss:
+            backend = f"faiss/{self.index_type}"
+        else:
+            backend = "numba" if self.use_numba else "numpy"
+        if self.quantize:
+            backend += f"/{self.quantize}"
+        logger.info(f"FaceMatcher initialized with threshold={self.threshold}, backend={backend}")
+        
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        """Return a contiguous FP32 copy of the embedding scaled to unit length"""
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        return vector / (np.linalg.norm(vector) + 1e-6)
+        
+    async def _reload_matrix(self):
+        """Load all stored embeddings into a normalized (N, D) matrix; a failed fetch raises and keeps the cache"""
+        rows = []
+        person_ids = []
+        person_meta = {}
+        doc_ids = {}
+        
+        self._added_during_reload = {}
+        try:
+            persons = await self.db_handler.get_all_persons_with_embeddings()
+        except Exception:
+            self._added_during_reload = None
+            raise
+        
+        for person in persons:
+            try:
+                stored_embedding = decode_embedding(person)
+                
+                # Validate stored embedding
+                if stored_embedding.ndim != 1 or len(stored_embedding) == 0:
+                    logger.warning(f"Invalid stored embedding for person {person['person_id']}")
+                    continue
+                    
+                if rows and len(stored_embedding) != len(rows[0]):
+                    logger.warning(f"Embedding dimension mismatch for person {person['person_id']}")
+                    continue
+                    
+                rows.append(stored_embedding)
+                person_ids.append(person['person_id'])
+                doc_ids[person.get('_id')] = person['person_id']
+                person_meta[person['person_id']] = {
+                    'first_seen': person.get('first_seen'),
+                    'last_seen': person.get('last_seen'),
+                    'detection_count': person.get('detection_count', 0)
+                }
+                
+            except Exception as e:
+                logger.error(f"Error loading person {person.get('person_id')}: {e}")
+                continue
+        
+        # Registrations and synced inserts that landed after the snapshot was read
+        added, self._added_during_reload = self._added_during_reload, None
+        for person_id, normalized in added.items():
+            if person_id in person_meta or (rows and len(normalized) != len(rows[0])):
+                continue
+            rows.append(normalized)
+            person_ids.append(person_id)
+            person_meta[person_id] = self.person_meta.get(person_id, {'detection_count': 0})
+        doc_ids.update({doc_id: pid for doc_id, pid in self._doc_ids.items() if pid in added})
+        
+        if rows:
+            E = np.vstack(rows)
+            # New documents are stored normalized; this keeps legacy ones correct
+            E /= np.linalg.norm(E, axis=1, keepdims=True) + 1e-6
+        else:
+            E = np.empty((0, 0), dtype=np.float32)
+            
+        self._set_matrix(E, person_ids)
+        self.person_meta = person_meta
+        self._doc_ids = doc_ids
+        
+        logger.info(f"Loaded {len(person_ids)} embeddings into matcher cache")
+        
+    def _build_index(self, E: np.ndarray):
+        """Build a FAISS inner-product index over the normalized matrix"""
+        if not self.use_faiss:
+            return None
+            
+        dim = E.shape[1]
+        if self.quantize in ('int8', 'fp16'):
+            qtype = faiss.ScalarQuantizer.QT_8bit if self.quantize == 'int8' else faiss.ScalarQuantizer.QT_fp16
+            if self.index_type == 'hnsw':
+                index = faiss.IndexHNSWSQ(dim, qtype, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_INNER_PRODUCT)
+            # Unit vectors lie in [-1, 1] on every axis, so fix the range up front
+            # instead of training on (possibly tiny) gallery data
+            bounds = np.vstack([-np.ones(dim), np.ones(dim)]).astype(np.float32)
+            index.train(bounds)
+        elif self.index_type == 'hnsw':
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexFlatIP(dim)
+            
+        index.add(np.ascontiguousarray(E, dtype=np.float32))
+        return index
+        
+    def _set_matrix(self, E: np.ndarray, person_ids: List[str]):
+        """Replace the cache and rebuild everything derived from it"""
+        self.E = E
+        self.person_ids = person_ids
+        self.index = self._build_index(E) if person_ids else None
+        
+        if self._uses_int8_kernel():
+            if E.shape[0] == 0:
+                # Empty gallery (fresh database, last person removed): nothing to quantize
+                self.E_q = np.empty((0, E.shape[1]), dtype=np.int8)
+                self.scales = np.empty(0, dtype=np.float32)
+            else:
+                self.E_q, self.scales = _quantize(E)
+            
+    def _uses_int8_kernel(self) -> bool:
+        return self.quantize == 'int8' and not self.use_faiss
+        
+    def _append_row(self, person_id: str, normalized: np.ndarray):
+        """Append a normalized embedding to the in-memory matrix, replacing any row for person_id"""
+        if self._added_during_reload is not None:
+            self._added_during_reload[person_id] = normalized
+            
+        if person_id in self.person_ids:
+            # Our own insert can come back through the change stream before
+            # _register_new_person caches it; a second row would survive a delete
+            E = self.E.copy()
+            E[self.person_ids.index(person_id)] = normalized
+            self._set_matrix(E, list(self.person_ids))
+            return
+            
+        if not self.person_ids:
+            self.E = normalized[None, :].copy()
+            self.index = self._build_index(self.E)
+        else:
+            self.E = np.vstack([self.E, normalized])
+            if self.index is not None:
+                self.index.add(np.ascontiguousarray(normalized[None, :]))
+                
+        if self._uses_int8_kernel():
+            row_q, row_scale = _quantize(normalized[None, :])
+            if not self.person_ids:
+                self.E_q, self.scales = row_q, row_scale
+            else:
+                self.E_q = np.vstack([self.E_q, row_q])
+                self.scales = np.concatenate([self.scales, row_scale])
+            
+        self.person_ids.append(person_id)
+        
+    def _remove_row(self, person_id: str):
+        """Drop a person from the cache; indexes are rebuilt since rows shift"""
+        if self._added_during_reload is not None:
+            self._added_during_reload.pop(person_id, None)
+            
+        try:
+            idx = self.person_ids.index(person_id)
+        except ValueError:
+            return
+            
+        person_ids = self.person_ids[:idx] + self.person_ids[idx + 1:]
+        E = np.delete(self.E, idx, axis=0) if person_ids else np.empty((0, 0), dtype=np.float32)
+        self._set_matrix(E, person_ids)
+        self.person_meta.pop(person_id, None)
+        
+    def _apply_change(self, change: Dict):
+        """Apply one change-stream event to the cache"""
+        operation = change.get('operationType')
+        doc_id = change.get('documentKey', {}).get('_id')
+        
+        if operation == 'delete':
+            person_id = self._doc_ids.pop(doc_id, None)
+            if person_id:
+                self._remove_row(person_id)
+                logger.info(f"Removed {person_id} from matcher cache")
+            return
+            
+        person = change.get('fullDocument')
+        if not person or 'person_id' not in person:
+            return
+            
+        person_id = person['person_id']
+        self._doc_ids[doc_id] = person_id
+        
+        # Our own inserts are already cached by _register_new_person
+        if operation == 'insert' and person_id in self.person_meta:
+            return
+            
+        stored_embedding = decode_embedding(person)
+        if len(stored_embedding) == 0 or (self.person_ids and len(stored_embedding) != self.E.shape[1]):
+            logger.warning(f"Ignoring change with invalid embedding for {person_id}")
+            return
+            
+        self._append_row(person_id, self._normalize(stored_embedding))
+        self.person_meta[person_id] = {
+            'first_seen': person.get('first_seen'),
+            'last_seen': person.get('last_seen'),
+            'detection_count': person.get('detection_count', 0)
+        }
+        logger.info(f"Synced {person_id} into matcher cache ({operation})")
+            
+    async def start(self):
+        """Load the cache and keep it in sync with writes made by other processes"""
+        if self._sync_task is not None and not self._sync_task.done():
+            return
+            
+        await self._reload_matrix()
+        self._sync_task = asyncio.get_running_loop().create_task(self._sync_loop())
+        
+    async def stop(self):
+        for task in (self._sync_task, self._batch_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+            
+    async def _sync_loop(self):
+        while True:
+            stream = await self.db_handler.watch()
+            
+            if stream is None:
+                # No change streams (standalone mongod): fall back to periodic reloads
+                logger.info(f"Reloading matcher cache every {self.reload_interval}s")
+                while True:
+                    await asyncio.sleep(self.reload_interval)
+                    try:
+                        await self._reload_matrix()
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        # The previous cache stays in place until a reload succeeds
+                        logger.error(f"Matcher cache reload failed: {e}")
+                
+            try:
+                async with stream:
+                    while stream.alive:
+                        change = await stream.try_next()
+                        if change is not None:
+                            self._apply_change(change)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Change stream error: {e}")
+                await asyncio.sleep(1)
+        
+    def _search(self, query: np.ndarray) -> Tuple[int, float]:
+        """Return (row index, cosine similarity) of the closest stored embedding"""
+        if self.index is not None:
+            D, I = self.index.search(np.ascontiguousarray(query[None, :]), 1)
+            return int(I[0, 0]), float(D[0, 0])
+            
+        if self._uses_int8_kernel():
+            q_q, q_scale = _quantize(query)
+            best_idx, best_sim = _argmax_cosine_int8(self.E_q, self.scales, q_q, float(q_scale))
+            return int(best_idx), float(best_sim)
+            
+        if self.use_numba:
+            best_idx, best_sim = _argmax_cosine(self.E, query)
+            return int(best_idx), float(best_sim)
+            
+        sims = self.E @ query
+        best_idx = int(np.argmax(sims))
+        return best_idx, float(sims[best_idx])
+        
+    def _search_batch(self, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Batched _search over a (B, D) query matrix"""
+        if not self.person_ids:
+            return np.full(len(queries), -1), np.full(len(queries), -1.0, dtype=np.float32)
+            
+        if self.index is not None:
+            D, I = self.index.search(np.ascontiguousarray(queries), 1)
+            return I[:, 0], D[:, 0]
+            
+        if self._uses_int8_kernel() or self.use_numba:
+            results = [self._search(query) for query in queries]
+            return (
+                np.array([idx for idx, _ in results]),
+                np.array([sim for _, sim in results], dtype=np.float32)
+            )
+            
+        # One GEMM reuses E from cache for every query in the batch
+        S = self.E @ queries.T
+        best_idx = np.argmax(S, axis=0)
+        return best_idx, S[best_idx, np.arange(S.shape[1])]
+        
+    async def _search_async(self, query: np.ndarray) -> Tuple[Optional[str], float]:
+        """Queue a query for the batch worker and wait for its (person_id, similarity)"""
+        loop = asyncio.get_running_loop()
+        
+        if self._batch_task is None or self._batch_task.done():
+            self._query_queue = asyncio.Queue()
+            self._batch_task = loop.create_task(self._batch_worker())
+            
+        future = loop.create_future()
+        self._query_queue.put_nowait((query, future))
+        return await future
+        
+    async def _batch_worker(self):
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            batch = [await self._query_queue.get()]
+            deadline = loop.time() + self.batch_window
+            
+            # Collect whatever else arrives within the window
+            while True:
+                try:
+                    batch.append(self._query_queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                    
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._query_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                    
+            try:
+                best_idx, best_sims = self._search_batch(np.stack([query for query, _ in batch]))
+                person_ids = [self.person_ids[i] if i >= 0 else None for i in best_idx]
+            except Exception as e:
+                logger.error(f"Batched search failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+                
+            logger.debug(f"Matched a batch of {len(batch)} queries")
+            
+            for (_, future), person_id, similarity in zip(batch, person_ids, best_sims):
+                if not future.done():
+                    future.set_result((person_id, float(similarity)))
         
     def compute_similarity(self, emb1: np.ndarray, emb2: np.ndarray) -> float:
-        """Compute cosine similarity between two embeddings"""
-        # Normalize embeddings
+        """Compute cosine similarity between a query and a stored (unit-length) embedding"""
+        # Stored embeddings are normalized at insert time, only the query needs it
         emb1_norm = emb1 / (np.linalg.norm(emb1) + 1e-6)
-        emb2_norm = emb2 / (np.linalg.norm(emb2) + 1e-6)
         
         # Compute cosine similarity
-        similarity = np.dot(emb1_norm, emb2_norm)
+        similarity = np.dot(emb1_norm, emb2)
         
         return float(similarity)
         
@@ -42,50 +470,36 @@ class FaceMatcher:
                 'error': 'Invalid embedding'
             }
         
-        # Get all persons from database
-        all_persons = self.db_handler.get_all_persons()
+        query = self._normalize(embedding)
         
-        if not all_persons:
+        if not self.person_ids:
             logger.info("Database is empty, registering first person")
             return await self._register_new_person(embedding)
+            
+        if query.shape[0] != self.E.shape[1]:
+            logger.error(f"Embedding dimension {query.shape[0]} does not match stored dimension {self.E.shape[1]}")
+            return {
+                'matched': False,
+                'person_id': None,
+                'confidence': 0.0,
+                'is_new_detection': False,
+                'error': 'Invalid embedding'
+            }
         
-        logger.debug(f"Comparing against {len(all_persons)} persons in database")
+        logger.debug(f"Comparing against {len(self.person_ids)} persons in cache")
         
-        best_match = None
-        best_similarity = -1
-        
-        # Find best match
-        for person in all_persons:
-            try:
-                stored_embedding = np.array(person['embedding'])
-                
-                # Validate stored embedding
-                if stored_embedding is None or len(stored_embedding) == 0:
-                    logger.warning(f"Invalid stored embedding for person {person['person_id']}")
-                    continue
-                
-                similarity = self.compute_similarity(embedding, stored_embedding)
-                
-                logger.debug(f"Similarity with {person['person_id']}: {similarity:.3f}")
-                
-                if similarity > best_similarity:
-                    best_similarity = similarity
-                    best_match = person
-                    
-            except Exception as e:
-                logger.error(f"Error comparing with person {person['person_id']}: {e}")
-                continue
+        person_id, best_similarity = await self._search_async(query)
         
         current_time = datetime.utcnow()
         
         # Check if similarity exceeds threshold
-        if best_similarity >= self.threshold:
-            logger.info(f"Match found: {best_match['person_id']} with similarity {best_similarity:.3f}")
+        if person_id is not None and best_similarity >= self.threshold:
             
-            person_id = best_match['person_id']
+            logger.info(f"Match found: {person_id} with similarity {best_similarity:.3f}")
             
             # Check if this is a new detection (based on cooldown)
-            last_seen_dt = best_match.get('last_seen')
+            meta = self.person_meta.setdefault(person_id, {'detection_count': 0})
+            last_seen_dt = meta.get('last_seen')
             is_new_detection = True
             
             if last_seen_dt:
@@ -94,37 +508,49 @@ class FaceMatcher:
                     is_new_detection = False
                     logger.debug(f"Within cooldown period ({time_diff:.1f}s)")
             
-            # Update person in database
-            self.db_handler.update_person(
-                person_id=person_id,
-                last_seen=current_time
-            )
+            # Track counters locally; with batched writes, reading the
+            # person back here could return stale values
+            meta['last_seen'] = current_time
+            meta['detection_count'] = meta.get('detection_count', 0) + 1
             
-            # Get updated person data
-            updated_person = self.db_handler.get_person(person_id)
+            if self.db_handler.write_batch_size > 1:
+                await self.db_handler.update_person(
+                    person_id=person_id,
+                    last_seen=current_time
+                )
+            else:
+                # Unbatched: update and read back the authoritative counters in one call
+                updated_person = await self.db_handler.touch_person(person_id, current_time)
+                if updated_person:
+                    meta['first_seen'] = updated_person.get('first_seen')
+                    meta['detection_count'] = updated_person.get('detection_count', meta['detection_count'])
             
             return {
                 'matched': True,
                 'person_id': person_id,
                 'confidence': float(best_similarity),
                 'is_new_detection': is_new_detection,
-                'first_seen': updated_person['first_seen'].strftime('%Y-%m-%d %H:%M:%S') if updated_person.get('first_seen') else 'N/A',
+                'first_seen': meta['first_seen'].strftime('%Y-%m-%d %H:%M:%S') if meta.get('first_seen') else 'N/A',
                 'last_seen': current_time.strftime('%Y-%m-%d %H:%M:%S'),
-                'detection_count': updated_person.get('detection_count', 0)
+                'detection_count': meta['detection_count']
             }
         else:
             # No match found, register as new person
             logger.info(f"No match found (best similarity: {best_similarity:.3f}), registering new person")
             return await self._register_new_person(embedding)
     
+    async def match_faces(self, embeddings: List[np.ndarray]) -> List[Dict]:
+        """Match several embeddings at once; the batch worker runs them as one search"""
+        return await asyncio.gather(*(self.match_face(embedding) for embedding in embeddings))
+        
     async def _register_new_person(self, embedding: np.ndarray) -> Dict:
         """Register a new person in the database"""
         person_id = generate_unique_id()
         current_time = datetime.utcnow()
         
-        success = self.db_handler.insert_person(
+        success = await self.db_handler.insert_person(
             person_id=person_id,
-            embedding=embedding.tolist(),
+            embedding=embedding,
             first_seen=current_time,
             last_seen=current_time
         )
@@ -139,6 +565,13 @@ class FaceMatcher:
                 'error': 'Database insertion failed'
             }
         
+        self._append_row(person_id, self._normalize(embedding))
+        self.person_meta[person_id] = {
+            'first_seen': current_time,
+            'last_seen': current_time,
+            'detection_count': 1
+        }
+        
         logger.info(f"New person registered: {person_id}")
         
         return {
@@ -1,12 +1,26 @@
 import logging
 from typing import Optional
 import asyncio
-from collections import defaultdict
-from datetime import datetime, timedelta
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
 
+def _dumps(data: dict) -> str:
+    """Serialize a notification once; datetimes become ISO 8601 strings"""
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, default=lambda o: o.isoformat())
+
+
 class Notifier:
     def __init__(self, config):
         self.config = config.get('notifications', {})
@@ -15,18 +29,19 @@ class Notifier:
         self.desktop_enabled = self.config.get('desktop', False)
         self.websocket_enabled = self.config.get('websocket', True)
         self.cooldown_seconds = self.config.get('cooldown_seconds', 60)
+        self.max_tracked_persons = self.config.get('max_tracked_persons', 10000)
         
-        self.last_notification = defaultdict(lambda: datetime.min)
+        # time.monotonic() of the last notification per person, oldest first
+        self.last_notification = OrderedDict()
         self.websocket_clients = set()
         
     def should_notify(self, person_id: str) -> bool:
         if not self.enabled:
             return False
             
-        last_time = self.last_notification[person_id]
-        current_time = datetime.utcnow()
+        last_time = self.last_notification.get(person_id)
         
-        if current_time - last_time < timedelta(seconds=self.cooldown_seconds):
+        if last_time is not None and time.monotonic() - last_time < self.cooldown_seconds:
             return False
             
         return True
@@ -40,7 +55,7 @@ class Notifier:
         if not self.should_notify(person_id):
             return
             
-        self.last_notification[person_id] = datetime.utcnow()
+        self._record_notification(person_id)
         
         message = f"Person {person_id} detected (confidence: {confidence:.2f})"
         
@@ -53,11 +68,24 @@ class Notifier:
                 'person_id': person_id,
                 'confidence': confidence,
                 'bbox': bbox,
-                'timestamp': datetime.utcnow().isoformat()
+                'timestamp': datetime.utcnow()
             })
             
         logger.info(f"Notification sent: {message}")
         
+    def _record_notification(self, person_id: str):
+        now = time.monotonic()
+        self.last_notification[person_id] = now
+        self.last_notification.move_to_end(person_id)
+        
+        # Entries are ordered by notification time, so expired cooldowns sit at
+        # the front; drop those, then enforce the size cap
+        while self.last_notification:
+            oldest_id, oldest_time = next(iter(self.last_notification.items()))
+            if now - oldest_time < self.cooldown_seconds and len(self.last_notification) <= self.max_tracked_persons:
+                break
+            self.last_notification.popitem(last=False)
+            
     async def _send_desktop_notification(self, message: str):
         try:
             from plyer import notification
@@ -73,13 +101,20 @@ class Notifier:
         if not self.websocket_clients:
             return
             
+        clients = list(self.websocket_clients)
+        payload = _dumps(data)
+        
+        # Send to every client concurrently; total latency is the slowest send
+        results = await asyncio.gather(
+            *(client.send_text(payload) for client in clients),
+            return_exceptions=True
+        )
+        
         disconnected = set()
         
-        for client in self.websocket_clients:
-            try:
-                await client.send_json(data)
-            except Exception as e:
-                logger.error(f"WebSocket send failed: {e}")
+        for client, result in zip(clients, results):
+            if isinstance(result, Exception):
+                logger.error(f"WebSocket send failed: {result}")
                 disconnected.add(client)
                 
         self.websocket_clients -= disconnected
@@ -1,13 +1,22 @@
 import cv2
 import numpy as np
 import logging
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 import insightface
 from insightface.app import FaceAnalysis
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from detector import BatchDetector
 
 logger = logging.getLogger(__name__)
 
+# Annotation colors (BGR) and font
+GREEN = (0, 255, 0)  # Known faces
+ORANGE = (255, 165, 0)  # New faces
+RED = (0, 0, 255)  # Rejected by quality checks
+GRAY = (128, 128, 128)  # Too small to process
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
 
 class FaceRecognitionPipeline:
     def __init__(self, config, quality_checker, matcher, notifier):
@@ -19,66 +28,176 @@ class FaceRecognitionPipeline:
         self.det_thresh = self.config.get('det_thresh', 0.5)
         self.min_face_size = self.config.get('min_face_size', 40)
         
+        # Draw annotations on a cv2.UMat so the frame can stay on the OpenCL device
+        self.use_umat = config.get('camera', {}).get('opencl', False)
+        
+        # Frames buffered between pipeline stages
+        self.queue_size = self.config.get('queue_size', 2)
+        # Single worker so detection keeps frame order and one model session
+        self._detect_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="detect")
+        
+        # Timestamps and detection counts under each box are for debugging
+        self.show_details = self.config.get('show_details', False)
+        
+        # Quality checks are OpenCV work that releases the GIL; keep them off the event loop
+        self._cpu_pool = ThreadPoolExecutor(
+            max_workers=self.config.get('quality_workers', 2), thread_name_prefix="quality"
+        )
+        
+        # Notifications run as background tasks; insertion-ordered so the oldest can be dropped
+        self._notify_tasks: Dict[asyncio.Task, None] = {}
+        self.max_pending_notifications = self.config.get('max_pending_notifications', 100)
+        
+        # Frames waiting together are detected in one batched inference
+        self.batch_size = self.config.get('batch_size', 4)
+        
         logger.info("Initializing InsightFace models...")
         self.app = FaceAnalysis(
             providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
         )
         self.app.prepare(ctx_id=0, det_thresh=self.det_thresh, det_size=(640, 640))
+        self.detector = BatchDetector(self.app)
         logger.info("InsightFace models loaded successfully")
         
     async def process_stream(self, camera):
+        """Run capture, detection and match/annotate as overlapping stages"""
         camera.start()
         
-        frame_count = 0
+        # Bounded queues give back-pressure: a slow stage drops stale frames
+        det_q = asyncio.Queue(maxsize=self.queue_size)
+        # Room for a whole detection batch so it is not dropped on arrival
+        annot_q = asyncio.Queue(maxsize=max(self.queue_size, self.batch_size))
+        
+        try:
+            await asyncio.gather(
+                self._capture_task(camera, det_q),
+                self._detect_task(det_q, annot_q),
+                self._annotate_task(camera, annot_q)
+            )
+        finally:
+            self._detect_executor.shutdown(wait=False)
+            self._cpu_pool.shutdown(wait=False)
+            
+    @staticmethod
+    def _put_latest(queue: asyncio.Queue, item):
+        """Enqueue an item, dropping the oldest one if the queue is full"""
+        if queue.full():
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        queue.put_nowait(item)
+        
+    async def _capture_task(self, camera, det_q: asyncio.Queue):
+        loop = asyncio.get_running_loop()
         
         while True:
-            frame = camera.get_frame()
+            # get_frame blocks on the capture thread, keep it off the event loop; frames
+            # are owned because the queues and the annotated frame outlive ring slots
+            seq, frame = await loop.run_in_executor(None, lambda: camera.get_frame_tagged(owned=True))
             if frame is None:
                 await asyncio.sleep(0.01)
                 continue
+                
+            self._put_latest(det_q, (seq, frame))
             
-            frame_count += 1
+    async def _detect_task(self, det_q: asyncio.Queue, annot_q: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            items = [await det_q.get()]
             
-            # Process every 3rd frame to reduce load
-            if frame_count % 3 != 0:
-                await asyncio.sleep(0.01)
-                continue
+            # Batch only what is already pending; waiting for more frames would
+            # just add latency when the camera delivers one at a time
+            while len(items) < self.batch_size and not det_q.empty():
+                items.append(det_q.get_nowait())
                 
+            frames = [frame for _, frame in items]
+            batch_faces = await loop.run_in_executor(self._detect_executor, self.detect_batch, frames)
+            for (seq, frame), faces in zip(items, batch_faces):
+                self._put_latest(annot_q, (seq, frame, faces))
+            
+    async def _annotate_task(self, camera, annot_q: asyncio.Queue):
+        while True:
+            seq, frame, faces = await annot_q.get()
+            
             try:
-                annotated_frame = await self.process_frame(frame)
-                camera.set_annotated_frame(annotated_frame)
+                annotated_frame = await self.annotate_faces(frame, faces)
+                # Nothing drawn means the stream can reuse the raw frame's encode
+                camera.set_annotated_frame(annotated_frame, seq if annotated_frame is frame else None)
             except Exception as e:
                 logger.error(f"Frame processing error: {e}")
-                camera.set_annotated_frame(frame)
+                camera.set_annotated_frame(frame, seq)
                 await asyncio.sleep(0.1)
+                
+    def _notify_in_background(self, **kwargs):
+        """Send a notification without holding up the frame"""
+        if len(self._notify_tasks) >= self.max_pending_notifications:
+            oldest = next(iter(self._notify_tasks))
+            self._notify_tasks.pop(oldest)
+            oldest.cancel()
+            logger.warning("Too many pending notifications, dropped the oldest")
             
-    async def process_frame(self, frame: np.ndarray) -> np.ndarray:
-        annotated = frame.copy()
+        task = asyncio.get_running_loop().create_task(self.notifier.notify(**kwargs))
+        self._notify_tasks[task] = None
+        task.add_done_callback(self._notify_done)
+        
+    def _notify_done(self, task: asyncio.Task):
+        self._notify_tasks.pop(task, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Notification failed: {task.exception()}")
+            
+    @staticmethod
+    def _draw_annotation(annotated, x1: int, y1: int, x2: int, y2: int, label: str, color, scale: float = 0.6):
+        """Draw a bounding box with a single label above it"""
+        cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(annotated, label, (x1, y1 - 10), FONT, scale, color, 2)
         
+    def _copy_for_annotation(self, frame: np.ndarray):
+        """Clone the frame once we know something will be drawn on it"""
+        return cv2.UMat(frame) if self.use_umat else frame.copy()
+        
+    def detect_faces(self, frame: np.ndarray) -> List:
         try:
             # Detect faces in the frame
-            faces = self.app.get(frame)
-            
-            # If no faces detected, return the original frame
-            if not faces or len(faces) == 0:
-                logger.debug("No faces detected in frame")
-                return annotated
-                
+            return self.detector.get(frame)
         except Exception as e:
             logger.error(f"Face detection failed: {e}")
-            return annotated
+            return []
+            
+    def detect_batch(self, frames: List[np.ndarray]) -> List[List]:
+        try:
+            return self.detector.get_batch(frames)
+        except Exception as e:
+            logger.error(f"Batched face detection failed: {e}")
+            return [[] for _ in frames]
+            
+    async def process_frame(self, frame: np.ndarray) -> np.ndarray:
+        return await self.annotate_faces(frame, self.detect_faces(frame))
+        
+    async def annotate_faces(self, frame: np.ndarray, faces: List):
+        # If no faces detected, return the original frame
+        if not faces:
+            logger.debug("No faces detected in frame")
+            return frame
+            
+        # Most frames have nothing to draw, so only copy on first annotation
+        annotated = None
+        loop = asyncio.get_running_loop()
+        
+        # Upper bounds for clipping (x1, y1, x2, y2) to the frame
+        height, width = frame.shape[:2]
+        clip_hi = np.array([width, height, width, height], dtype=np.float32)
+        
+        # (bbox, embedding) of faces that pass size and quality checks
+        survivors = []
         
         logger.info(f"Detected {len(faces)} face(s) in frame")
         
         for face in faces:
-            bbox = face.bbox.astype(int)
-            x1, y1, x2, y2 = bbox
-            
             # Ensure bbox is within frame boundaries
-            x1 = max(0, x1)
-            y1 = max(0, y1)
-            x2 = min(frame.shape[1], x2)
-            y2 = min(frame.shape[0], y2)
+            bbox = np.clip(face.bbox, 0, clip_hi).astype(np.int32)
+            x1, y1, x2, y2 = bbox.tolist()
             
             w = x2 - x1
             h = y2 - y1
@@ -86,14 +205,13 @@ class FaceRecognitionPipeline:
             # Check minimum face size
             if w < self.min_face_size or h < self.min_face_size:
                 logger.debug(f"Face too small: {w}x{h}")
-                cv2.rectangle(annotated, (x1, y1), (x2, y2), (128, 128, 128), 2)
-                cv2.putText(
-                    annotated, "Too Small", (x1, y1 - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (128, 128, 128), 2
-                )
+                if annotated is None:
+                    annotated = self._copy_for_annotation(frame)
+                self._draw_annotation(annotated, x1, y1, x2, y2, "Too Small", GRAY, 0.5)
                 continue
                 
-            # Extract face region
+            # Extract face region as a strided view; cvtColor in the quality check
+            # reads it directly and embeddings come from the full frame, so no copy
             face_img = frame[y1:y2, x1:x2]
             
             # Validate face crop
@@ -102,20 +220,18 @@ class FaceRecognitionPipeline:
                 continue
             
             # Check face quality
-            quality_score, quality_issues = self.quality_checker.check_quality(
-                face_img, face
+            quality_score, quality_issues = await loop.run_in_executor(
+                self._cpu_pool, self.quality_checker.check_quality, face_img, face
             )
             
             logger.debug(f"Face quality score: {quality_score:.2f}, issues: {quality_issues}")
             
             # Reject low quality faces
-            if quality_score < 0.5:
-                cv2.rectangle(annotated, (x1, y1), (x2, y2), (0, 0, 255), 2)
+            if quality_score < self.quality_checker.min_score:
+                if annotated is None:
+                    annotated = self._copy_for_annotation(frame)
                 issue_text = ", ".join(quality_issues) if quality_issues else "Low Quality"
-                cv2.putText(
-                    annotated, issue_text, (x1, y1 - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2
-                )
+                self._draw_annotation(annotated, x1, y1, x2, y2, issue_text, RED, 0.5)
                 logger.debug(f"Face rejected due to quality issues: {quality_issues}")
                 continue
             
@@ -124,6 +240,7 @@ class FaceRecognitionPipeline:
                 logger.warning("Face has no embedding, skipping")
                 continue
                 
+            # Kept FP32: unmatched embeddings are registered and persisted as they are
             embedding = face.normed_embedding
             
             # Verify embedding is valid
@@ -132,9 +249,19 @@ class FaceRecognitionPipeline:
                 continue
             
             logger.info(f"Processing face with embedding shape: {embedding.shape}")
+            survivors.append((bbox, embedding))
+            
+        if not survivors:
+            return annotated if annotated is not None else frame
+            
+        # Match all faces of the frame against the database in one batched search
+        match_results = await self.matcher.match_faces([embedding for _, embedding in survivors])
+        
+        if annotated is None:
+            annotated = self._copy_for_annotation(frame)
             
-            # Match face against database
-            match_result = await self.matcher.match_face(embedding)
+        for (bbox, _), match_result in zip(survivors, match_results):
+            x1, y1, x2, y2 = bbox.tolist()
             
             if match_result['matched']:
                 person_id = match_result['person_id']
@@ -143,51 +270,20 @@ class FaceRecognitionPipeline:
                 last_seen = match_result.get('last_seen', 'N/A')
                 detection_count = match_result.get('detection_count', 0)
                 
-                color = (0, 255, 0)  # Green for known faces
+                # Bounding box with person ID and confidence
+                self._draw_annotation(annotated, x1, y1, x2, y2, f"ID: {person_id} ({confidence:.2f})", GREEN)
                 
-                # Draw bounding box
-                cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
-                
-                # Display person ID and confidence
-                label = f"ID: {person_id}"
-                cv2.putText(
-                    annotated, label, (x1, y1 - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2
-                )
-                
-                # Display confidence
-                conf_text = f"Conf: {confidence:.2f}"
-                cv2.putText(
-                    annotated, conf_text, (x1, y1 - 30),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2
-                )
-                
-                # Display detection count
-                count_text = f"Seen: {detection_count}x"
-                cv2.putText(
-                    annotated, count_text, (x1, y2 + 20),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1
-                )
-                
-                # Display first seen
-                first_text = f"First: {first_seen}"
-                cv2.putText(
-                    annotated, first_text, (x1, y2 + 40),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1
-                )
-                
-                # Display last seen
-                last_text = f"Last: {last_seen}"
-                cv2.putText(
-                    annotated, last_text, (x1, y2 + 60),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1
-                )
+                if self.show_details:
+                    # Display detection count, first and last seen
+                    cv2.putText(annotated, f"Seen: {detection_count}x", (x1, y2 + 20), FONT, 0.5, GREEN, 1)
+                    cv2.putText(annotated, f"First: {first_seen}", (x1, y2 + 40), FONT, 0.4, GREEN, 1)
+                    cv2.putText(annotated, f"Last: {last_seen}", (x1, y2 + 60), FONT, 0.4, GREEN, 1)
                 
                 logger.info(f"Matched person: {person_id} with confidence {confidence:.2f}")
                 
                 # Send notification for new detection
                 if match_result['is_new_detection']:
-                    await self.notifier.notify(
+                    self._notify_in_background(
                         person_id=person_id,
                         confidence=confidence,
                         bbox=bbox.tolist()
@@ -197,29 +293,16 @@ class FaceRecognitionPipeline:
                 person_id = match_result['person_id']
                 first_seen = match_result.get('first_seen', 'N/A')
                 
-                color = (255, 165, 0)  # Orange for new faces
-                
-                # Draw bounding box
-                cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
+                # Bounding box with new person label
+                self._draw_annotation(annotated, x1, y1, x2, y2, f"NEW: {person_id}", ORANGE)
                 
-                # Display new person label
-                label = f"NEW: {person_id}"
-                cv2.putText(
-                    annotated, label, (x1, y1 - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2
-                )
-                
-                # Display first seen
-                first_text = f"First: {first_seen}"
-                cv2.putText(
-                    annotated, first_text, (x1, y2 + 20),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1
-                )
+                if self.show_details:
+                    cv2.putText(annotated, f"First: {first_seen}", (x1, y2 + 20), FONT, 0.4, ORANGE, 1)
                 
                 logger.info(f"New person registered: {person_id}")
                 
                 # Send notification for new person
-                await self.notifier.notify(
+                self._notify_in_background(
                     person_id=person_id,
                     confidence=0.0,
                     bbox=bbox.tolist()
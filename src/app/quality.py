@@ -1,10 +1,76 @@
 import cv2
 import numpy as np
 import logging
+import threading
+from collections import OrderedDict
 from typing import Tuple, List
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 logger = logging.getLogger(__name__)
 
+# Bit i of an issue mask maps to ISSUE_LABELS[i]
+ISSUE_LABELS = ("blurry", "too_dark", "too_bright", "too_small", "bad_pose")
+
+# More strict threshold for frontal faces
+MAX_POSE_ANGLE = 25
+
+# Gray buffers are bucketed to multiples of this many pixels per side
+GRAY_BUCKET = 16
+# Buckets kept per thread before the oldest is evicted
+GRAY_POOL_SIZE = 8
+
+# Each sub-check contributes a normalized score in [0, 1]; the overall score is their mean
+NUM_CHECKS = 4
+
+
+def _score_geometry(face_size, pose_angle, min_size, max_pose):
+    """Size + pose sub-scores and their issue bits"""
+    total = 0.0
+    issue_mask = 0
+    
+    if face_size >= min_size:
+        total += min(1.0, face_size / 150.0)
+    else:
+        issue_mask |= 8
+        
+    if pose_angle < max_pose:
+        # Normalize pose score (lower angle is better)
+        total += 1.0 - pose_angle / max_pose
+    else:
+        issue_mask |= 16
+        
+    return total, issue_mask
+
+
+def _score_brightness(brightness, min_brightness, max_brightness):
+    if min_brightness <= brightness <= max_brightness:
+        # Normalize brightness (closer to 128 is better)
+        return 1.0 - abs(brightness - 128.0) / 128.0, 0
+    elif brightness < min_brightness:
+        return 0.0, 2
+    return 0.0, 4
+
+
+def _score_blur(laplacian_var, blur_thresh):
+    if laplacian_var >= blur_thresh:
+        # Normalize blur score (higher is better)
+        return min(1.0, laplacian_var / (2.0 * blur_thresh)), 0
+    return 0.0, 1
+
+
+if numba is not None:
+    _score_geometry = numba.njit(fastmath=True, cache=True)(_score_geometry)
+    _score_brightness = numba.njit(fastmath=True, cache=True)(_score_brightness)
+    _score_blur = numba.njit(fastmath=True, cache=True)(_score_blur)
+
+
+def _issue_labels(issue_mask: int) -> List[str]:
+    return [label for bit, label in enumerate(ISSUE_LABELS) if issue_mask & (1 << bit)]
+
 
 class QualityChecker:
     def __init__(self, config):
@@ -14,28 +80,70 @@ class QualityChecker:
         self.min_brightness = self.config.get('min_brightness', 50)
         self.max_brightness = self.config.get('max_brightness', 210)
         self.min_face_size = self.config.get('min_face_size', 60)
+        # Faces scoring below this are rejected; lets check_quality stop early
+        self.min_score = self.config.get('min_score', 0.5)
+        
+        # Reusable grayscale buffers; per thread because checks run on a pool
+        self._local = threading.local()
         
         logger.info(f"QualityChecker initialized: blur_thresh={self.min_blur_threshold}, "
                    f"brightness=[{self.min_brightness}, {self.max_brightness}], "
                    f"min_size={self.min_face_size}")
         
+    def _gray_buffer(self, h: int, w: int) -> np.ndarray:
+        """A view of this thread's pooled (h, w) gray buffer"""
+        local = self._local
+        if not hasattr(local, 'pool'):
+            local.pool = OrderedDict()
+            
+        mask = GRAY_BUCKET - 1
+        key = ((h + mask) & ~mask, (w + mask) & ~mask)
+        
+        buf = local.pool.get(key)
+        if buf is None:
+            if len(local.pool) >= GRAY_POOL_SIZE:
+                local.pool.popitem(last=False)
+            buf = local.pool[key] = np.empty(key, dtype=np.uint8)
+            
+        return buf[:h, :w]
+        
+    def _gray(self, face_img: np.ndarray) -> np.ndarray:
+        """Full-resolution grayscale crop, shared by blur and brightness"""
+        # Kept at crop resolution: downsampling a blurred crop sharpens it, so a
+        # Laplacian on a resampled copy would pass blurry close-up faces
+        gray = self._gray_buffer(*face_img.shape[:2])
+        # The result stays valid until this thread's next call
+        return cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY, dst=gray)
+        
+    @staticmethod
+    def _laplacian_var(gray: np.ndarray) -> float:
+        # Single-pass stddev over a float32 Laplacian instead of .var() on float64
+        _, stddev = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_32F))
+        return float(stddev[0, 0]) ** 2
+        
+    def _gray_stats(self, face_img: np.ndarray) -> Tuple[float, float]:
+        """Mean brightness and Laplacian variance from a single grayscale conversion"""
+        gray = self._gray(face_img)
+        return cv2.mean(gray)[0], self._laplacian_var(gray)
+        
     def check_blur(self, face_img: np.ndarray) -> Tuple[float, bool]:
         """Check if face image is blurry using Laplacian variance"""
         if face_img is None or face_img.size == 0:
             return 0.0, False
             
         try:
-            gray = cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
-            laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-            
-            is_sharp = laplacian_var >= self.min_blur_threshold
-            
-            logger.debug(f"Blur check: variance={laplacian_var:.1f}, sharp={is_sharp}")
-            
-            return laplacian_var, is_sharp
+            _, laplacian_var = self._gray_stats(face_img)
+            return self._check_blur_value(laplacian_var)
         except Exception as e:
             logger.error(f"Blur check failed: {e}")
             return 0.0, False
+            
+    def _check_blur_value(self, laplacian_var: float) -> Tuple[float, bool]:
+        is_sharp = laplacian_var >= self.min_blur_threshold
+        
+        logger.debug(f"Blur check: variance={laplacian_var:.1f}, sharp={is_sharp}")
+        
+        return laplacian_var, is_sharp
         
     def check_brightness(self, face_img: np.ndarray) -> Tuple[float, bool]:
         """Check if face has good lighting/brightness"""
@@ -43,17 +151,18 @@ class QualityChecker:
             return 0.0, False
             
         try:
-            gray = cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
-            mean_brightness = np.mean(gray)
-            
-            is_good = self.min_brightness <= mean_brightness <= self.max_brightness
-            
-            logger.debug(f"Brightness check: value={mean_brightness:.1f}, good={is_good}")
-            
-            return mean_brightness, is_good
+            mean_brightness, _ = self._gray_stats(face_img)
+            return self._check_brightness_value(mean_brightness)
         except Exception as e:
             logger.error(f"Brightness check failed: {e}")
             return 0.0, False
+            
+    def _check_brightness_value(self, mean_brightness: float) -> Tuple[float, bool]:
+        is_good = self.min_brightness <= mean_brightness <= self.max_brightness
+        
+        logger.debug(f"Brightness check: value={mean_brightness:.1f}, good={is_good}")
+        
+        return mean_brightness, is_good
         
     def check_face_size(self, face) -> Tuple[int, bool]:
         """Check if face is large enough for reliable recognition"""
@@ -83,8 +192,7 @@ class QualityChecker:
             
             max_angle = max(pitch, yaw, roll)
             
-            # More strict threshold for frontal faces
-            is_frontal = max_angle < 25
+            is_frontal = max_angle < MAX_POSE_ANGLE
             
             logger.debug(f"Pose check: pitch={pitch:.1f}, yaw={yaw:.1f}, roll={roll:.1f}, frontal={is_frontal}")
             
@@ -102,58 +210,47 @@ class QualityChecker:
         Comprehensive quality check for face image
         Returns: (overall_score, list_of_issues)
         """
-        issues = []
-        scores = []
-        
-        # Check blur
-        blur_score, is_sharp = self.check_blur(face_img)
-        if not is_sharp:
-            issues.append("blurry")
-            scores.append(0.0)
-        else:
-            # Normalize blur score (higher is better)
-            normalized_blur = min(1.0, blur_score / 300)
-            scores.append(normalized_blur)
-            
-        # Check brightness
-        brightness, is_good_light = self.check_brightness(face_img)
-        if not is_good_light:
-            if brightness < self.min_brightness:
-                issues.append("too_dark")
-            else:
-                issues.append("too_bright")
-            scores.append(0.0)
-        else:
-            # Normalize brightness (closer to 128 is better)
-            normalized_brightness = 1.0 - (abs(brightness - 128) / 128)
-            scores.append(normalized_brightness)
-            
-        # Check face size
-        face_size, is_large = self.check_face_size(face)
-        if not is_large:
-            issues.append("too_small")
-            scores.append(0.0)
-        else:
-            # Normalize size score
-            normalized_size = min(1.0, face_size / 150)
-            scores.append(normalized_size)
+        # Cheapest checks first; stop once the best reachable score is below min_score
+        face_size, _ = self.check_face_size(face)
+        pose_angle, _ = self.check_pose(face)
+        
+        total, issue_mask = _score_geometry(
+            float(face_size), float(pose_angle), float(self.min_face_size), float(MAX_POSE_ANGLE)
+        )
+        if (total + 2) / NUM_CHECKS < self.min_score:
+            return self._early_reject(issue_mask)
             
-        # Check pose
-        pose_angle, is_frontal = self.check_pose(face)
-        if not is_frontal:
-            issues.append("bad_pose")
-            scores.append(0.0)
-        else:
-            # Normalize pose score (lower angle is better)
-            normalized_pose = 1.0 - (pose_angle / 25)
-            scores.append(normalized_pose)
+        # Brightness and blur share one grayscale conversion
+        gray = None
+        if face_img is not None and face_img.size > 0:
+            try:
+                gray = self._gray(face_img)
+            except Exception as e:
+                logger.error(f"Blur/brightness check failed: {e}")
+                
+        brightness = cv2.mean(gray)[0] if gray is not None else 0.0
+        score, mask = _score_brightness(
+            float(brightness), float(self.min_brightness), float(self.max_brightness)
+        )
+        total += score
+        issue_mask |= mask
+        if (total + 1) / NUM_CHECKS < self.min_score:
+            return self._early_reject(issue_mask)
             
-        # Calculate overall quality score
-        if not scores:
-            overall_score = 0.0
-        else:
-            overall_score = np.mean(scores)
+        laplacian_var = self._laplacian_var(gray) if gray is not None else 0.0
+        score, mask = _score_blur(float(laplacian_var), float(self.min_blur_threshold))
+        total += score
+        issue_mask |= mask
+        
+        overall_score = total / NUM_CHECKS
+        issues = _issue_labels(issue_mask)
         
         logger.debug(f"Quality check result: score={overall_score:.2f}, issues={issues}")
         
-        return overall_score, issues
\ No newline at end of file
+        return overall_score, issues
+        
+    @staticmethod
+    def _early_reject(issue_mask: int) -> Tuple[float, List[str]]:
+        issues = _issue_labels(issue_mask)
+        logger.debug(f"Quality check rejected early: issues={issues}")
+        return 0.0, issues
\ No newline at end of file
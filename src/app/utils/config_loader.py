@@ -1,11 +1,25 @@
 import yaml
 import os
+import copy
 import logging
+from functools import lru_cache
 from typing import Any, Dict
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=8)
+def _parse_config(config_path: str, mtime: float) -> Dict:
+    """Parse a YAML file once per (path, mtime); callers must copy the result"""
+    with open(config_path, 'r') as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+
 class ConfigLoader:
     def __init__(self, config_path: str):
         self.config_path = config_path
@@ -14,10 +28,11 @@ class ConfigLoader:
         
     def _load_config(self) -> Dict:
         try:
-            with open(self.config_path, 'r') as f:
-                config = yaml.safe_load(f)
-                logger.info(f"Configuration loaded from {self.config_path}")
-                return config
+            mtime = os.path.getmtime(self.config_path)
+            # Env overrides mutate the config, so never hand out the cached dict
+            config = copy.deepcopy(_parse_config(self.config_path, mtime))
+            logger.info(f"Configuration loaded from {self.config_path}")
+            return config
         except FileNotFoundError:
             logger.error(f"Config file not found: {self.config_path}")
             return {}
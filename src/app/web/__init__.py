@@ -1,2 +1,3 @@
 from .api import *
-from .stream import *
\ No newline at end of file
+from .stream import *
+from .encoders import *
\ No newline at end of file
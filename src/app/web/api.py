@@ -2,6 +2,7 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
+import asyncio
 import logging
 from typing import Optional
 
@@ -19,12 +20,17 @@ app.add_middleware(
 
 camera_instance = None
 db_handler_instance = None
+notifier_instance = None
 
+# Idle websocket clients are pinged this often so dead connections get dropped
+ws_ping_interval = 30
 
-def set_instances(camera, db_handler):
-    global camera_instance, db_handler_instance
+
+def set_instances(camera, db_handler, notifier=None):
+    global camera_instance, db_handler_instance, notifier_instance
     camera_instance = camera
     db_handler_instance = db_handler
+    notifier_instance = notifier
 
 
 @app.get("/")
@@ -47,7 +53,7 @@ async def get_statistics():
     if not db_handler_instance:
         raise HTTPException(status_code=503, detail="Database not available")
         
-    stats = db_handler_instance.get_statistics()
+    stats = await db_handler_instance.get_statistics()
     return JSONResponse(content=stats)
 
 
@@ -56,7 +62,7 @@ async def get_all_persons():
     if not db_handler_instance:
         raise HTTPException(status_code=503, detail="Database not available")
         
-    persons = db_handler_instance.get_all_persons()
+    persons = await db_handler_instance.get_all_persons()
     
     result = []
     for person in persons:
@@ -75,7 +81,7 @@ async def get_person(person_id: str):
     if not db_handler_instance:
         raise HTTPException(status_code=503, detail="Database not available")
         
-    person = db_handler_instance.get_person(person_id)
+    person = await db_handler_instance.get_person(person_id)
     
     if not person:
         raise HTTPException(status_code=404, detail="Person not found")
@@ -93,7 +99,7 @@ async def delete_person(person_id: str):
     if not db_handler_instance:
         raise HTTPException(status_code=503, detail="Database not available")
         
-    success = db_handler_instance.delete_person(person_id)
+    success = await db_handler_instance.delete_person(person_id)
     
     if not success:
         raise HTTPException(status_code=404, detail="Person not found")
@@ -105,23 +111,43 @@ async def delete_person(person_id: str):
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     
+    if notifier_instance:
+        notifier_instance.add_websocket_client(websocket)
+    
     try:
         while True:
-            data = await websocket.receive_text()
-            
+            try:
+                message = await asyncio.wait_for(websocket.receive(), timeout=ws_ping_interval)
+            except asyncio.TimeoutError:
+                # A failed ping raises, which ends the loop for half-open connections
+                await websocket.send_json({"type": "ping"})
+                continue
+                
+            if message["type"] == "websocket.disconnect":
+                break
+                
+        logger.info("WebSocket client disconnected")
+        
     except WebSocketDisconnect:
         logger.info("WebSocket client disconnected")
+    except Exception as e:
+        logger.warning(f"WebSocket connection lost: {e}")
+    finally:
+        if notifier_instance:
+            notifier_instance.remove_websocket_client(websocket)
 
 
-async def start_api_server(config, camera, db_handler):
-    set_instances(camera, db_handler)
+async def start_api_server(config, camera, db_handler, notifier=None):
+    global ws_ping_interval
+    set_instances(camera, db_handler, notifier)
     
     api_config = config.get('api', {})
+    ws_ping_interval = api_config.get('ws_ping_interval', 30)
     host = api_config.get('host', '0.0.0.0')
     port = api_config.get('port', 8000)
     
     from web.stream import setup_stream_routes
-    setup_stream_routes(app, camera)
+    setup_stream_routes(app, camera, config)
     
     config_obj = uvicorn.Config(
         app,
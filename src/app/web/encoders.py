@@ -0,0 +1,168 @@
+import cv2
+import logging
+import numpy as np
+import threading
+from typing import Optional, Union
+
+# Encoders return bytes or a zero-copy view; both can be sent as response chunks
+JpegData = Union[bytes, memoryview]
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+except ImportError:
+    TurboJPEG = None
+
+try:
+    from nvjpeg import NvJpeg
+except ImportError:
+    NvJpeg = None
+
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+except (ImportError, ValueError):
+    Gst = None
+
+logger = logging.getLogger(__name__)
+
+
+class JpegEncoder:
+    """Software fallback through cv2.imencode; backends override encode()"""
+    name = "opencv"
+    
+    @classmethod
+    def available(cls) -> bool:
+        return True
+        
+    def encode(self, frame, quality: int = 80) -> Optional[JpegData]:
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        # imencode returns a fresh array per call, so a view over it is safe to keep
+        return memoryview(buffer).cast('B') if ret else None
+
+
+class TurboJpegEncoder(JpegEncoder):
+    """libjpeg-turbo via PyTurboJPEG, taking BGR frames without a color swap"""
+    name = "turbojpeg"
+    
+    @classmethod
+    def available(cls) -> bool:
+        return TurboJPEG is not None
+        
+    def __init__(self):
+        self._tj = TurboJPEG()
+        
+    def encode(self, frame, quality: int = 80) -> Optional[JpegData]:
+        # Camera frames are contiguous BGR, so libjpeg-turbo converts straight to
+        # YCbCr in its SIMD path with no separate cvtColor
+        return self._tj.encode(frame, quality=quality, pixel_format=TJPF_BGR)
+
+
+class NvJpegEncoder(JpegEncoder):
+    """CUDA nvJPEG via pynvjpeg; DCT and Huffman coding run on the GPU"""
+    name = "nvjpeg"
+    
+    @classmethod
+    def available(cls) -> bool:
+        if NvJpeg is None or not hasattr(cv2, 'cuda'):
+            return False
+        try:
+            return cv2.cuda.getCudaEnabledDeviceCount() > 0
+        except cv2.error:
+            return False
+            
+    def __init__(self):
+        # nvJPEG handles are not shared between the encode pool threads
+        self._local = threading.local()
+        
+    def encode(self, frame, quality: int = 80) -> Optional[JpegData]:
+        if not hasattr(self._local, 'nj'):
+            self._local.nj = NvJpeg()
+        return self._local.nj.encode(frame, quality)
+
+
+class GstJpegEncoder(JpegEncoder):
+    """GStreamer appsrc ! videoconvert ! jpegenc ! appsink; conversion and encode run in C"""
+    name = "gstreamer"
+    
+    @classmethod
+    def available(cls) -> bool:
+        if Gst is None or not Gst.init_check(None)[0]:
+            return False
+        return Gst.ElementFactory.find('jpegenc') is not None
+        
+    def __init__(self):
+        # One pipeline per encode pool thread, rebuilt when the frame size changes
+        self._local = threading.local()
+        
+    def _pipeline(self, width: int, height: int):
+        state = getattr(self._local, 'state', None)
+        if state is not None and state[0] == (width, height):
+            return state
+            
+        self._drop_pipeline()
+        pipeline = Gst.parse_launch(
+            f"appsrc name=src format=time caps=video/x-raw,format=BGR,width={width},height={height},framerate=0/1 "
+            "! videoconvert ! jpegenc name=enc ! appsink name=sink sync=false"
+        )
+        pipeline.set_state(Gst.State.PLAYING)
+        state = self._local.state = (
+            (width, height), pipeline,
+            pipeline.get_by_name('src'), pipeline.get_by_name('enc'), pipeline.get_by_name('sink')
+        )
+        return state
+        
+    def _drop_pipeline(self):
+        state = getattr(self._local, 'state', None)
+        if state is not None:
+            state[1].set_state(Gst.State.NULL)
+            self._local.state = None
+            
+    def encode(self, frame, quality: int = 80) -> Optional[JpegData]:
+        height, width = frame.shape[:2]
+        _, _, src, enc, sink = self._pipeline(width, height)
+        
+        # Raw BGR caps imply rows padded to 4 bytes; packed frames of other widths would shear
+        row = width * 3
+        stride = (row + 3) & ~3
+        if stride != row:
+            padded = np.zeros((height, stride), dtype=np.uint8)
+            padded[:, :row] = frame.reshape(height, row)
+            frame = padded
+            
+        enc.set_property('quality', quality)
+        src.emit('push-buffer', Gst.Buffer.new_wrapped(frame.tobytes()))
+        
+        # Pulling blocks with the GIL released until jpegenc has produced the frame
+        sample = sink.emit('try-pull-sample', Gst.SECOND)
+        if sample is None:
+            # The late sample would be returned for the next frame; start clean instead
+            logger.warning("GStreamer JPEG encode timed out, rebuilding the pipeline")
+            self._drop_pipeline()
+            return None
+        buffer = sample.get_buffer()
+        return buffer.extract_dup(0, buffer.get_size())
+
+
+# "auto" tries these in order; gstreamer follows the always-available opencv
+# encoder, so it is only used when configured by name
+ENCODERS = {cls.name: cls for cls in (NvJpegEncoder, TurboJpegEncoder, JpegEncoder, GstJpegEncoder)}
+
+
+def create_encoder(name: str = "auto") -> JpegEncoder:
+    """Instantiate the named backend, or the fastest available one for "auto" """
+    candidates = list(ENCODERS.values()) if name == "auto" else [ENCODERS.get(name, JpegEncoder)]
+
+    for cls in candidates:
+        if not cls.available():
+            continue
+        try:
+            encoder = cls()
+            logger.info(f"Using {encoder.name} JPEG encoder")
+            return encoder
+        except Exception as e:
+            # e.g. PyTurboJPEG installed but libturbojpeg missing
+            logger.warning(f"{cls.name} JPEG encoder unavailable: {e}")
+
+    logger.info("Using opencv JPEG encoder")
+    return JpegEncoder()
\ No newline at end of file
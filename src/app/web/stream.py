@@ -1,69 +1,324 @@
-from fastapi import Response
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
 import cv2
 import asyncio
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Set, Tuple, Union
+import numpy as np
+from web.encoders import JpegData, JpegEncoder, create_encoder
 
 logger = logging.getLogger(__name__)
 
+# Encoders release the GIL, so concurrent viewers encode in parallel off the event loop
+_JPEG_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="jpeg")
 
-def setup_stream_routes(app, camera):
+# Multipart framing around each frame
+_BOUNDARY_PREFIX = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+_PPM_BOUNDARY_PREFIX = b'--frame\r\nContent-Type: image/x-portable-pixmap\r\n\r\n'
+_BOUNDARY_SUFFIX = b'\r\n'
+
+
+class AdaptiveQuality:
+    """JPEG quality that steps down when encodes overrun the frame budget and back up when idle"""
     
-    @app.get("/stream/raw")
-    async def stream_raw():
-        return StreamingResponse(
-            generate_raw_stream(camera),
-            media_type="multipart/x-mixed-replace; boundary=frame"
-        )
+    def __init__(self, quality: int = 80, target_fps: float = 30, min_quality: int = 40,
+                 max_quality: int = 90, enabled: bool = True, alpha: float = 0.2):
+        self.value = quality
+        self.frame_budget = 1.0 / target_fps
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.enabled = enabled
+        self.alpha = alpha
+        self.ewma = 0.0
+        self._lock = threading.Lock()
+        
+    def update(self, encode_seconds: float):
+        """Fold one encode time into the EWMA; called from the encode pool threads"""
+        if not self.enabled:
+            return
+            
+        with self._lock:
+            self.ewma += self.alpha * (encode_seconds - self.ewma)
+            
+            if self.ewma > self.frame_budget and self.value > self.min_quality:
+                self.value = max(self.min_quality, self.value - 10)
+                logger.debug(f"JPEG encode {self.ewma * 1000:.1f}ms over budget, quality -> {self.value}")
+            elif self.ewma < 0.5 * self.frame_budget and self.value < self.max_quality:
+                self.value = min(self.max_quality, self.value + 10)
+
+
+# Replaced by setup_stream_routes with the backend and quality settings from config
+_encoder: JpegEncoder = JpegEncoder()
+# AdaptiveQuality arguments; each hub keeps its own instance so one slow stream
+# does not lower the quality of the others
+_quality_settings: Dict = {'enabled': False}
+
+
+def _encode_jpeg(frame, quality: AdaptiveQuality) -> Optional[JpegData]:
+    """Encode a BGR frame to JPEG with the configured backend at the stream's current quality"""
+    try:
+        start = time.perf_counter()
+        frame_bytes = _encoder.encode(frame, quality.value)
+        quality.update(time.perf_counter() - start)
+        return frame_bytes
+    except Exception as e:
+        logger.error(f"JPEG encode failed ({_encoder.name}): {e}")
+        return None
+
+
+def _encode_ppm(frame, quality: AdaptiveQuality) -> memoryview:
+    """Uncompressed RGB PPM for LAN viewers: a header plus one color conversion, no DCT or quality"""
+    h, w = frame.shape[:2]
+    header = b'P6\n%d %d\n255\n' % (w, h)
     
-    @app.get("/stream/annotated")
-    async def stream_annotated():
-        return StreamingResponse(
-            generate_annotated_stream(camera),
-            media_type="multipart/x-mixed-replace; boundary=frame"
-        )
+    # Convert straight into the output buffer behind the header
+    out = np.empty(len(header) + h * w * 3, dtype=np.uint8)
+    out[:len(header)] = np.frombuffer(header, dtype=np.uint8)
+    cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=out[len(header):].reshape(h, w, 3))
+    return memoryview(out)
+
 
+# ?format= value -> (encoder, multipart part header)
+_FORMATS = {
+    'jpeg': (_encode_jpeg, _BOUNDARY_PREFIX),
+    'ppm': (_encode_ppm, _PPM_BOUNDARY_PREFIX),
+}
 
-async def generate_raw_stream(camera):
-    while True:
-        frame = camera.get_latest_frame()
+# Latest encode per stream and format: key -> (frame seq, future of the framed part)
+_jpeg_cache = {}
+
+
+async def _encode_cached(key: str, seq: int, frame, encode,
+                        same_as: Optional[Tuple[str, int]] = None) -> Optional[JpegData]:
+    """Encode each (stream, seq) once; viewers asking for the same frame share it"""
+    # same_as names a (key, seq) entry with identical pixels, reused while still cached
+    cached = _jpeg_cache.get(key)
+    if cached is None or cached[0] != seq:
+        other = _jpeg_cache.get(same_as[0]) if same_as else None
+        if other is not None and other[0] == same_as[1]:
+            future = other[1]
+        else:
+            future = asyncio.get_running_loop().run_in_executor(
+                _JPEG_POOL, encode, frame
+            )
+        cached = _jpeg_cache[key] = (seq, future)
+        
+    # A viewer disconnecting mid-encode must not cancel it for the others
+    return await asyncio.shield(cached[1])
+
+
+class BroadcastHub:
+    """Encodes each frame of one stream once and fans the result out to every viewer"""
+    
+    def __init__(self, camera, kind: str, fmt: str = 'jpeg', size: Optional[Tuple[int, int]] = None,
+                 registry: Optional[Dict[tuple, 'BroadcastHub']] = None):
+        self.camera = camera
+        self.kind = kind
+        self.fmt = fmt
+        # Optional (w, h) to downscale to before encoding, for small viewports
+        self.size = size
+        self._encode_fn, self.part_prefix = _FORMATS[fmt]
+        self.quality = AdaptiveQuality(**_quality_settings)
+        # Full-size raw JPEG can be the camera's own MJPEG frames, sent without re-encoding
+        self.passthrough = kind == 'raw' and fmt == 'jpeg' and size is None
+        self._suffix = f".{fmt}" + (f".{size[0]}x{size[1]}" if size else "")
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+        # Shared lookup the hub sits in only while it has viewers, keyed by (kind, fmt, size)
+        self.key = (kind, fmt, size)
+        self._registry = registry
         
-        if frame is None:
-            await asyncio.sleep(0.03)
-            continue
+    def subscribe(self) -> asyncio.Queue:
+        # One slot per viewer: a slow client skips frames instead of queueing them
+        queue = asyncio.Queue(maxsize=1)
+        self._subscribers.add(queue)
+        
+        if self._registry is not None:
+            self._registry.setdefault(self.key, self)
             
-        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+        
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
         
-        if not ret:
-            continue
+        if self._subscribers:
+            return
+            
+        # Nobody watching: stop encoding and release the last encoded frame
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            
+        # The raw key can be shared with a hub still running; it just re-encodes once
+        for key in (('raw', 'annotated') if self.kind == 'annotated' else ('raw',)):
+            _jpeg_cache.pop(key + self._suffix, None)
             
-        frame_bytes = buffer.tobytes()
+        # A replacement hub may already be registered under the same key
+        if self._registry is not None and self._registry.get(self.key) is self:
+            del self._registry[self.key]
+            
+    def encode(self, frame: Union[np.ndarray, memoryview]) -> Optional[bytes]:
+        """Encoded frame wrapped in its multipart framing, ready to send as one body chunk"""
+        if isinstance(frame, memoryview):
+            # Already a JPEG straight from the camera
+            data = frame
+        else:
+            if self.size is not None:
+                # Downscale only, clamped to the frame the camera actually delivers
+                height, width = frame.shape[:2]
+                size = (min(self.size[0], width), min(self.size[1], height))
+                if size != (width, height):
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            data = self._encode_fn(frame, self.quality)
+        if data is None:
+            return None
+        # Framed once per frame in the pool thread and shared by every viewer, so each
+        # viewer sends a single ASGI message (one transport write) instead of three
+        return b''.join((self.part_prefix, data, _BOUNDARY_SUFFIX))
+        
+    def _latest(self) -> Tuple[str, int, Optional[np.ndarray], Optional[int]]:
+        """(cache key, seq, frame, raw seq it equals) to send; annotated falls back to raw frames"""
+        if self.kind == 'annotated':
+            seq, source_seq, frame = self.camera.get_latest_annotated_tagged()
+            if frame is not None:
+                return 'annotated', seq, frame, source_seq
+                
+        if self.passthrough and self.camera.mjpeg:
+            seq, jpeg = self.camera.get_latest_jpeg_tagged()
+            if jpeg is not None:
+                return 'raw', seq, jpeg, None
+                
+        seq, frame = self.camera.get_latest_frame_tagged()
+        return 'raw', seq, frame, None
         
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    async def _run(self):
+        wait_for_frame = self.camera.wait_for_frame
+        subscribers = self._subscribers
+        # Stream whose frames are being sent: an annotated hub serving the raw
+        # fallback (before the first annotated frame) has to pace on raw frames
+        wait_kind = 'raw' if self.camera.get_latest_annotated() is None else self.kind
         
-        await asyncio.sleep(0.03)
+        while True:
+            try:
+                # Each new frame goes out as soon as it exists; on timeout the last one is resent
+                await wait_for_frame(wait_kind, timeout=1.0)
+                key, seq, frame, source_seq = self._latest()
+                wait_kind = key
+                
+                if frame is None:
+                    continue
+                    
+                # Frames with nothing drawn on them share the raw stream's encode
+                same_as = ('raw' + self._suffix, source_seq) if source_seq is not None else None
+                part = await _encode_cached(key + self._suffix, seq, frame, self.encode, same_as)
+                
+                if part is None:
+                    continue
+                    
+                for queue in subscribers:
+                    if queue.full():
+                        queue.get_nowait()
+                    queue.put_nowait(part)
+                    
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{self.kind} stream broadcast error: {e}")
+                await asyncio.sleep(0.1)
 
 
-async def generate_annotated_stream(camera):
-    while True:
-        frame = camera.get_latest_annotated()
-        
-        if frame is None:
-            frame = camera.get_latest_frame()
+def setup_stream_routes(app, camera, config=None):
+    global _encoder, _quality_settings
+    stream_config = (config or {}).get('stream', {})
+    _encoder = create_encoder(stream_config.get('encoder', 'auto'))
+    _quality_settings = dict(
+        quality=stream_config.get('jpeg_quality', 80),
+        target_fps=(config or {}).get('camera', {}).get('fps', 30),
+        min_quality=stream_config.get('min_jpeg_quality', 40),
+        max_quality=stream_config.get('max_jpeg_quality', 90),
+        enabled=stream_config.get('adaptive_quality', True)
+    )
+    
+    # One hub per (stream, format, size) so viewers with the same request share encodes;
+    # hubs register on their first viewer and drop out after the last one
+    hubs: Dict[tuple, BroadcastHub] = {}
+    
+    def get_hub(kind: str, fmt: str, w: Optional[int], h: Optional[int]) -> BroadcastHub:
+        if fmt not in _FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported format: {fmt}")
+        if (w is None) != (h is None) or (w is not None and (w <= 0 or h <= 0)):
+            raise HTTPException(status_code=400, detail="w and h must be given together and be positive")
             
-        if frame is None:
-            await asyncio.sleep(0.03)
-            continue
+        size = (w, h) if w is not None else None
+        hub = hubs.get((kind, fmt, size))
+        if hub is None:
+            # Not registered yet, so a viewer that never starts streaming leaves nothing behind
+            hub = BroadcastHub(camera, kind, fmt, size, registry=hubs)
+        return hub
+    
+    @app.get("/stream/raw")
+    async def stream_raw(format: str = 'jpeg', w: Optional[int] = None, h: Optional[int] = None):
+        # format=ppm skips compression entirely for viewers on a fast LAN
+        return StreamingResponse(
+            generate_stream(get_hub('raw', format, w, h)),
+            media_type="multipart/x-mixed-replace; boundary=frame"
+        )
+    
+    @app.get("/stream/annotated")
+    async def stream_annotated(w: Optional[int] = None, h: Optional[int] = None):
+        return StreamingResponse(
+            generate_stream(get_hub('annotated', 'jpeg', w, h)),
+            media_type="multipart/x-mixed-replace; boundary=frame"
+        )
+    
+    @app.websocket("/stream/ws")
+    async def stream_ws(websocket: WebSocket, stream: str = 'annotated',
+                        w: Optional[int] = None, h: Optional[int] = None):
+        # One binary JPEG message per frame, for canvas viewers; ?stream=raw|annotated
+        if stream not in ('raw', 'annotated'):
+            await websocket.close(code=1008)
+            return
             
-        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-        
-        if not ret:
-            continue
+        try:
+            hub = get_hub(stream, 'jpeg', w, h)
+        except HTTPException:
+            await websocket.close(code=1008)
+            return
             
-        frame_bytes = buffer.tobytes()
-        
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        await websocket.accept()
+        queue = hub.subscribe()
+        get_part = queue.get
+        # Parts carry their multipart framing; websocket messages are the bare JPEG
+        start, end = len(hub.part_prefix), -len(_BOUNDARY_SUFFIX)
         
-        await asyncio.sleep(0.03)
\ No newline at end of file
+        try:
+            while True:
+                part = await get_part()
+                # ASGI requires bytes here, not a memoryview, so the slice is a copy
+                await websocket.send_bytes(part[start:end])
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logger.warning(f"Stream websocket closed: {e}")
+        finally:
+            hub.unsubscribe(queue)
+
+
+async def generate_stream(hub: BroadcastHub):
+    """Multipart body for one viewer of any hub; raw and annotated only differ in their hub"""
+    queue = hub.subscribe()
+    # Bound once so the per-frame loop does no attribute lookups
+    get_part = queue.get
+    
+    try:
+        while True:
+            # Parts arrive already framed by the hub
+            yield await get_part()
+    finally:
+        hub.unsubscribe(queue)
\ No newline at end of file
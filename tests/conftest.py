@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules under src/app import each other by bare name, as when main.py runs from there
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'app'))
@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("numba")
+pytest.importorskip("motor")
+
+from matcher import FaceMatcher
+
+
+class EmptyDB:
+    async def get_all_persons_with_embeddings(self):
+        return []
+
+
+def make_int8_matcher():
+    config = {'matching': {'quantize': 'int8', 'use_faiss': False, 'use_numba': True}}
+    return FaceMatcher(config, EmptyDB())
+
+
+def test_int8_reload_of_empty_gallery():
+    matcher = make_int8_matcher()
+    assert matcher._uses_int8_kernel()
+
+    asyncio.run(matcher._reload_matrix())
+
+    assert matcher.person_ids == []
+    assert matcher.E_q.shape[0] == 0
+    assert matcher.E_q.dtype == np.int8
+    assert matcher.scales.shape == (0,)
+
+
+def test_int8_remove_last_person():
+    matcher = make_int8_matcher()
+    embedding = np.ones(512, dtype=np.float32)
+
+    matcher._append_row("PERSON_A", matcher._normalize(embedding))
+    matcher._remove_row("PERSON_A")
+
+    assert matcher.person_ids == []
+    assert matcher.E_q.shape[0] == 0
+    assert matcher.scales.shape == (0,)
@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+
+from quality import QualityChecker
+
+
+def textured_crop(size):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+
+
+def face_for(size):
+    return SimpleNamespace(bbox=np.array([0, 0, size, size], dtype=np.float32), pose=None)
+
+
+@pytest.mark.parametrize("size, sigma", [(250, 3), (400, 6), (150, 1.5)])
+def test_blurred_large_crop_is_rejected(size, sigma):
+    checker = QualityChecker({})
+    crop = cv2.GaussianBlur(textured_crop(size), (0, 0), sigma)
+
+    _, is_sharp = checker.check_blur(crop)
+    _, issues = checker.check_quality(crop, face_for(size))
+
+    assert not is_sharp
+    assert "blurry" in issues
+
+
+def test_sharp_crop_passes_blur_check():
+    checker = QualityChecker({})
+    crop = textured_crop(250)
+
+    _, is_sharp = checker.check_blur(crop)
+
+    assert is_sharp